@@ -0,0 +1,228 @@
+import os
+import time
+from array import array
+import numpy as np
+import torch
+import whisper
+from whisper.audio import N_SAMPLES, N_FRAMES, HOP_LENGTH, TOKENS_PER_SECOND
+from whisper.timing import median_filter, dtw, merge_punctuations, WordTiming
+from whisper.model import disable_sdpa
+import model_registry
+from chunked_transcription import frame_energies, find_chunk_boundaries, SAMPLE_RATE
+from pcm_audio import decode_asr_audio
+from speech_regions import find_speech_regions, concatenate_regions, restore_times
+from transcript import Transcript
+
+# Short chapters transcribed together: every queued chapter is cut at silences into windows of at most 30 s (one
+# Whisper input each), and the windows of several chapters are encoded and decoded as one batch. Word times come
+# from the same cross-attention DTW as whisper's word_timestamps, run as one batched decoder pass per batch, and
+# are split back per chapter. Windows are decoded without timestamp tokens or the previous window's text as a
+# prompt; a window whose output looks degenerate is decoded again at higher temperatures, as whisper does.
+
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
+
+def split_windows(audio, max_window_ms=30000):
+    # (start_ms, end_ms) windows covering the audio, cut at silences and no longer than one Whisper input
+    energies = frame_energies(None, audio=audio)
+    boundaries = find_chunk_boundaries(energies, target_chunk_ms=max_window_ms * 5 // 6, max_chunk_ms=max_window_ms)
+    boundaries[-1] = len(audio) * 1000 // SAMPLE_RATE
+    windows = []
+    for start_ms, end_ms in zip(boundaries, boundaries[1:]):
+        while end_ms - start_ms > max_window_ms:
+            windows.append((start_ms, start_ms + max_window_ms))
+            start_ms += max_window_ms
+        if end_ms > start_ms:
+            windows.append((start_ms, end_ms))
+    return windows
+
+
+def decode_windows(model, audio_features, language, fp16):
+    # Batched greedy decode with whisper's temperature fallback for degenerate or low-confidence windows
+    results = [None] * len(audio_features)
+    remaining = list(range(len(audio_features)))
+    for temperature in TEMPERATURES:
+        options = whisper.DecodingOptions(language=language, task='transcribe', temperature=temperature,
+                                          without_timestamps=True, fp16=fp16)
+        decoded = whisper.decode(model, audio_features[remaining], options)
+        retry = []
+        for index, result in zip(remaining, decoded):
+            results[index] = result
+            no_speech = result.no_speech_prob > 0.6 and result.avg_logprob < -1.0
+            if not no_speech and (result.compression_ratio > 2.4 or result.avg_logprob < -1.0):
+                retry.append(index)
+        if not retry:
+            break
+        remaining = retry
+    return [[] if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0 else result.tokens for result in results]
+
+
+def align_windows(model, tokenizer, audio_features, window_tokens, window_frames, medfilt_width=7):
+    # whisper.timing.find_alignment for a batch of windows: one decoder pass over the padded token sequences,
+    # keeping only the alignment heads' cross-attention
+    sequences = [[*tokenizer.sot_sequence, tokenizer.no_timestamps, *tokens, tokenizer.eot] for tokens in window_tokens]
+    length = max(len(sequence) for sequence in sequences)
+    tokens = torch.tensor([sequence + [tokenizer.eot] * (length - len(sequence)) for sequence in sequences],
+                          device=audio_features.device)
+    heads = model.alignment_heads.indices().T.tolist()
+    layer_heads = {}
+    for layer, head in heads:
+        layer_heads.setdefault(layer, []).append(head)
+    attention = {}
+    hooks = [
+        model.decoder.blocks[layer].cross_attn.register_forward_hook(
+            lambda _, ins, outs, layer=layer: attention.__setitem__(layer, outs[-1][:, layer_heads[layer]].float())
+        )
+        for layer in layer_heads
+    ]
+    try:
+        with torch.no_grad(), disable_sdpa():
+            logits = model.decoder(tokens, audio_features)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    # (windows, heads, tokens, frames) in model.alignment_heads order
+    weights = torch.stack([attention[layer][:, layer_heads[layer].index(head)] for layer, head in heads], dim=1)
+
+    sot_length = len(tokenizer.sot_sequence)
+    alignments = []
+    for index, text_tokens in enumerate(window_tokens):
+        if not text_tokens:
+            alignments.append([])
+            continue
+        sampled_logits = logits[index, sot_length:sot_length + len(text_tokens), :tokenizer.eot].float()
+        token_probs = sampled_logits.softmax(dim=-1)[np.arange(len(text_tokens)), text_tokens].tolist()
+
+        item_weights = weights[index, :, :len(sequences[index]), :window_frames[index] // 2]
+        item_weights = item_weights.softmax(dim=-1)
+        std, mean = torch.std_mean(item_weights, dim=-2, keepdim=True, unbiased=False)
+        item_weights = median_filter((item_weights - mean) / std, medfilt_width)
+        matrix = item_weights.mean(axis=0)[sot_length:-1]
+        text_indices, time_indices = dtw(-matrix)
+
+        words, word_tokens = tokenizer.split_to_word_tokens(text_tokens + [tokenizer.eot])
+        if len(word_tokens) <= 1:
+            alignments.append([])
+            continue
+        word_boundaries = np.pad(np.cumsum([len(t) for t in word_tokens[:-1]]), (1, 0))
+        jumps = np.pad(np.diff(text_indices), (1, 0), constant_values=1).astype(bool)
+        jump_times = time_indices[jumps] / TOKENS_PER_SECOND
+        alignment = [
+            WordTiming(word, word_token_ids, start, end, np.mean(token_probs[i:j]))
+            for word, word_token_ids, start, end, i, j in zip(words, word_tokens, jump_times[word_boundaries[:-1]],
+                                                               jump_times[word_boundaries[1:]],
+                                                               word_boundaries[:-1], word_boundaries[1:])
+        ]
+        merge_punctuations(alignment, PREPEND_PUNCTUATIONS, APPEND_PUNCTUATIONS)
+        alignments.append([timing for timing in alignment if timing.word])
+    return alignments
+
+
+def transcribe_batched(audios, language, whisper_model='small', whisper_device=None, whisper_precision=None,
+                       batch_size=8, skip_non_speech=False):
+    # audios: 16 kHz mono float32 arrays, one per chapter; returns one Transcript per chapter
+    key = model_registry.resolve_model_key(whisper_model, whisper_device, whisper_precision)
+    model = model_registry.get_model(*key)
+    fp16 = key[2] == 'fp16'
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                                language=language, task='transcribe')
+
+    # (chapter, window start ms, samples) for every window, plus the speech regions of each chapter
+    windows = []
+    chapter_regions = []
+    for chapter, audio in enumerate(audios):
+        regions = offsets = None
+        if skip_non_speech:
+            regions = find_speech_regions(audio)
+            audio, offsets = concatenate_regions(audio, regions)
+        chapter_regions.append((regions, offsets))
+        for start_ms, end_ms in split_windows(audio):
+            windows.append((chapter, start_ms, audio[start_ms * SAMPLE_RATE // 1000:end_ms * SAMPLE_RATE // 1000]))
+
+    transcripts = [Transcript() for _ in audios]
+    for batch_start in range(0, len(windows), batch_size):
+        batch = windows[batch_start:batch_start + batch_size]
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(samples, model.dims.n_mels, padding=N_SAMPLES)[:, :N_FRAMES]
+            for _, _, samples in batch
+        ]).to(model.device)
+        window_frames = [min(N_FRAMES, len(samples) // HOP_LENGTH) for _, _, samples in batch]
+        with torch.no_grad():
+            audio_features = model.embed_audio(mel.half() if fp16 else mel)
+        # Text tokens only, as in whisper's add_word_timestamps
+        window_tokens = [[token for token in tokens if token < tokenizer.eot]
+                         for tokens in decode_windows(model, audio_features, language, fp16)]
+        alignments = align_windows(model, tokenizer, audio_features, window_tokens, window_frames)
+        for (chapter, window_start_ms, _), alignment in zip(batch, alignments):
+            for timing in alignment:
+                transcripts[chapter].append(timing.word.strip().lower(), window_start_ms + int(timing.start * 1000),
+                                            window_start_ms + int(timing.end * 1000))
+
+    for transcript, (regions, offsets) in zip(transcripts, chapter_regions):
+        if regions is not None and len(transcript):
+            transcript.start_ms = array('i', restore_times(transcript.start_ms, regions, offsets).tolist())
+            transcript.end_ms = array('i', restore_times(transcript.end_ms, regions, offsets).tolist())
+    return transcripts
+
+
+class BatchedTranscriber:
+    # Same interface as TranscriptionPool: chapters are queued with prefetch, and the first transcribe call that
+    # needs a queued chapter transcribes it together with the chapters queued after it, until the group fills
+    # at least one batch of windows
+    def __init__(self, batch_size=8, whisper_model='small', whisper_device=None, whisper_precision=None):
+        self.batch_size = batch_size
+        self.whisper_model = whisper_model
+        self.whisper_device = whisper_device
+        self.whisper_precision = whisper_precision
+        print(f"Batched transcription: up to {batch_size} windows of 30 s per forward pass")
+        self._pending = {}
+        self._results = {}
+
+    def _job_key(self, audio_file, language, options):
+        return os.path.abspath(audio_file), language, tuple(sorted(options.items()))
+
+    def prefetch(self, audio_file, language, **options):
+        key = self._job_key(audio_file, language, options)
+        if key not in self._pending and key not in self._results:
+            self._pending[key] = (audio_file, language, options)
+
+    def transcribe(self, audio_file, language, **options):
+        self.prefetch(audio_file, language, **options)
+        key = self._job_key(audio_file, language, options)
+        if key not in self._results:
+            self._transcribe_group(key)
+        transcribed_words, elapsed = self._results.pop(key)
+        model_registry.timings['transcriptions'] += 1
+        model_registry.timings['transcribe_seconds'] += elapsed
+        return transcribed_words
+
+    def _transcribe_group(self, first_key):
+        # The requested chapter plus the next queued chapters with the same language and options
+        _, language, options = self._pending[first_key]
+        group = []
+        window_count = 0
+        for key in [first_key] + [k for k in self._pending if k != first_key]:
+            if window_count >= self.batch_size:
+                break
+            if key[1:] != first_key[1:]:
+                continue
+            audio = decode_asr_audio(self._pending.pop(key)[0])
+            group.append((key, audio))
+            window_count += -(-len(audio) // N_SAMPLES)
+
+        start_time = time.time()
+        transcripts = transcribe_batched([audio for _, audio in group], language, self.whisper_model,
+                                         self.whisper_device, self.whisper_precision, self.batch_size,
+                                         options.get('skip_non_speech', False))
+        elapsed = time.time() - start_time
+        total_samples = sum(len(audio) for _, audio in group) or 1
+        print(f"Transcribed {len(group)} chapters in {elapsed:.2f} seconds (batched)")
+        for (key, audio), transcript in zip(group, transcripts):
+            # Batch time attributed to each chapter by its length
+            self._results[key] = (transcript, elapsed * len(audio) / total_samples)
+
+    def shutdown(self):
+        self._pending.clear()
+        self._results.clear()
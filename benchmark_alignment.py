@@ -0,0 +1,215 @@
+import os
+import io
+import re
+import time
+import random
+import tempfile
+import contextlib
+from main import (align_verses, align_verses_dp, align_verses_anchored, align_verses_streaming, preprocess_text,
+                  get_numbered_book_name)
+from transcript import Transcript
+
+# Offline alignment benchmark: verse text (real, from a local ebible corpus file, or generated) is turned into a
+# synthetic Whisper transcript with controlled word drops, insertions, substitutions and intro noise, then each
+# aligner is timed against the known verse boundaries.
+
+ALIGNERS = {
+    'window': lambda words, verses, book, folder: align_verses(words, verses, book, folder, visualization='off'),
+    'window-batch': lambda words, verses, book, folder: align_verses(
+        words, verses, book, folder, scorer='batch', visualization='off'),
+    'adaptive': lambda words, verses, book, folder: align_verses(
+        words, verses, book, folder, scorer='batch', adaptive=True, visualization='off'),
+    'dp': lambda words, verses, book, folder: align_verses_dp(words, verses, book, folder, visualization='off'),
+    'anchored': lambda words, verses, book, folder: align_verses_anchored(
+        words, verses, book, folder, scorer='batch', visualization='off'),
+    'streaming': lambda words, verses, book, folder: list(align_verses_streaming(
+        ((w['word'], w['start'], w['end']) for w in words), verses, scorer='batch')),
+}
+
+def load_chapter_refs(chapter, vref_file='vref_eng.txt'):
+    # chapter is e.g. 'PSA 119'; returns (vref line index, 'PSA_119:1') pairs
+    refs = []
+    with open(vref_file, 'r') as f:
+        for i, line in enumerate(f):
+            ref = line.strip()
+            if ref.rsplit(':', 1)[0] == chapter:
+                refs.append((i, ref.replace(' ', '_')))
+    return refs
+
+def generate_vocabulary(rng, size=3000):
+    # Returns (words, cumulative Zipf weights) so sampled text has the heavy head of function words real verses have
+    syllables = [c + v for c in 'bcdfghjlmnprstvyz' for v in 'aeiou'] + list('aeiou')
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.choice((1, 2, 2, 3, 3, 4)))))
+    words = sorted(words)
+    rng.shuffle(words)
+    cumulative_weights = []
+    total = 0
+    for rank in range(1, size + 1):
+        total += 1 / rank
+        cumulative_weights.append(total)
+    return words, cumulative_weights
+
+def zipf_word(rng, vocabulary):
+    words, cumulative_weights = vocabulary
+    return rng.choices(words, cum_weights=cumulative_weights)[0]
+
+def build_verses(chapter, rng, vocabulary, bible_lines=None):
+    verses = []
+    for line_index, ref in load_chapter_refs(chapter):
+        if bible_lines is not None:
+            text = bible_lines[line_index].strip()
+        else:
+            text = ' '.join(zipf_word(rng, vocabulary) for _ in range(rng.randint(8, 40)))
+        verses.append([ref, text])
+    return verses
+
+def whisper_words(text, rng, comma_rate=0.12):
+    # Verse words as Whisper writes them: real text keeps its own casing and punctuation; generated text gets a
+    # capital letter, commas and a verse-final period
+    words = [word for word in text.split() if preprocess_text(word)]
+    if re.search(r'[^\w\s]', text) or not words:
+        return words
+    words = [word + ',' if rng.random() < comma_rate else word for word in words[:-1]] + [words[-1] + '.']
+    return [words[0].capitalize()] + words[1:]
+
+def synthesize_transcript(verses, rng, vocabulary, drop_rate=0.05, insert_rate=0.05, substitute_rate=0.1,
+                          intro_words=20, punctuation=True):
+    # Returns (transcribed_words, truth) where truth[i] = (start, end) word indices of verse i. With punctuation
+    # the words carry Whisper's casing and punctuation; otherwise they are normalized like the verse text.
+    transcribed_words = []
+    truth = []
+    position_ms = 0
+
+    def emit(word):
+        nonlocal position_ms
+        duration = rng.randint(150, 450)
+        transcribed_words.append({'word': word, 'start': position_ms, 'end': position_ms + duration})
+        position_ms += duration + rng.randint(20, 200)
+
+    for _ in range(intro_words):
+        emit(zipf_word(rng, vocabulary))
+
+    for verse in verses:
+        verse_start = len(transcribed_words)
+        for word in whisper_words(verse[1], rng) if punctuation else preprocess_text(verse[1]).split():
+            r = rng.random()
+            if r < drop_rate:
+                continue
+            if r < drop_rate + substitute_rate:
+                if len(word) > 2 and rng.random() < 0.7:
+                    i = rng.randrange(len(word))
+                    word = word[:i] + rng.choice('aeiounrst') + word[i + 1:]
+                else:
+                    word = zipf_word(rng, vocabulary)
+            emit(word)
+            if rng.random() < insert_rate:
+                emit(zipf_word(rng, vocabulary))
+        truth.append((verse_start, len(transcribed_words)))
+
+    return transcribed_words, truth
+
+def read_search_totals(book_name, output_folder):
+    fuzzy_file_path = os.path.join(output_folder, f"{get_numbered_book_name(book_name)}_fuzzy_ratios.txt")
+    if not os.path.exists(fuzzy_file_path):
+        return None
+    with open(fuzzy_file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('# total:'):
+                return {key: int(value) for key, value in re.findall(r'(\w+)=(\d+)', line)}
+    return None
+
+def boundary_errors(alignment, truth):
+    errors = []
+    for (start, end), (true_start, true_end) in zip(alignment, truth):
+        if start is None or end is None:
+            errors.append(None)
+        else:
+            errors.append((abs(start - true_start), abs(end - true_end)))
+    return errors
+
+def run_aligner(name, transcribed_words, verses, truth, tolerance_words=1):
+    book_name = verses[0][0].split('_')[0]
+    with tempfile.TemporaryDirectory() as output_folder:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            result = ALIGNERS[name](transcribed_words, verses, book_name, output_folder)
+            elapsed = time.perf_counter() - start_time
+
+        if name == 'streaming':
+            alignment = [(record['best_start'], record['best_end']) for record in result]
+            totals = {'scored': sum(record['counters']['scored'] for record in result),
+                      'candidates': sum(record['counters']['candidates'] for record in result)}
+        else:
+            alignment = result
+            totals = read_search_totals(book_name, output_folder)
+
+    errors = boundary_errors(alignment, truth)
+    found = [e for e in errors if e is not None]
+    return {
+        'aligner': name,
+        'seconds': elapsed,
+        'scored': totals['scored'] if totals else None,
+        'candidates': totals['candidates'] if totals else None,
+        'mean_error': sum(s + e for s, e in found) / (2 * len(found)) if found else None,
+        'within_tolerance': sum(1 for e in errors if e is not None and max(e) <= tolerance_words) / len(errors),
+        'missing': len(errors) - len(found),
+    }
+
+def format_result(chapter, verse_count, word_count, result):
+    scored = f"{result['scored']}/{result['candidates']}" if result['scored'] is not None else '-'
+    mean_error = f"{result['mean_error']:.2f}" if result['mean_error'] is not None else '-'
+    return (f"{chapter:<8} {verse_count:>6} {word_count:>6}  {result['aligner']:<13} {result['seconds']:>8.3f}s "
+            f"{scored:>20} {mean_error:>8} {result['within_tolerance'] * 100:>7.1f}% {result['missing']:>4}")
+
+def main():
+    #*******************PARAMETERS*******************#
+    chapters = ['JUD 1', 'MAT 1', 'GEN 1', 'JHN 6', 'PSA 119']  # shortest to longest
+    aligners = ['window', 'window-batch', 'adaptive', 'dp', 'anchored', 'streaming']
+    bible_text_file = None  # optional local ebible corpus .txt (one line per vref_eng.txt line); None = generated text
+    seed = 1
+    drop_rate = 0.05  # fraction of verse words missing from the transcript
+    insert_rate = 0.05  # chance of an extra word after each transcribed word
+    substitute_rate = 0.1  # fraction of words misspelled or replaced
+    intro_words = 20  # noise words before the first verse (chapter announcement, music)
+    punctuation = True  # transcript words with Whisper's casing and punctuation (False = normalized like the verse text)
+    tolerance_words = 1  # boundary error counted as correct
+    output_file = None  # e.g. 'bench_output.txt' to keep a copy of the report
+    #************************************************#
+
+    bible_lines = None
+    if bible_text_file:
+        with open(bible_text_file, 'r', encoding='utf-8') as f:
+            bible_lines = f.read().splitlines()
+
+    lines = [
+        f"drop={drop_rate} insert={insert_rate} substitute={substitute_rate} intro={intro_words} "
+        f"punctuation={punctuation} seed={seed} "
+        f"text={'generated' if bible_lines is None else bible_text_file}",
+        f"{'chapter':<8} {'verses':>6} {'words':>6}  {'aligner':<13} {'time':>9} {'scored/candidates':>20} "
+        f"{'err':>8} {'<=' + str(tolerance_words) + 'w':>8} {'miss':>4}"
+    ]
+    print('\n'.join(lines))
+    for chapter in chapters:
+        rng = random.Random(f"{seed}:{chapter}")
+        vocabulary = generate_vocabulary(rng)
+        verses = build_verses(chapter, rng, vocabulary, bible_lines)
+        if not verses:
+            print(f"No verses found for {chapter}")
+            continue
+        transcribed_words, truth = synthesize_transcript(verses, rng, vocabulary, drop_rate, insert_rate,
+                                                         substitute_rate, intro_words, punctuation)
+        transcript = Transcript.from_words(transcribed_words)
+        for name in aligners:
+            result = run_aligner(name, transcript, verses, truth, tolerance_words)
+            line = format_result(chapter, len(verses), len(transcribed_words), result)
+            lines.append(line)
+            print(line)
+
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+if __name__ == "__main__":
+    main()
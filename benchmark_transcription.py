@@ -0,0 +1,103 @@
+import io
+import time
+import difflib
+import contextlib
+import torch
+from ScriptureReference import ScriptureReference
+import model_registry
+from main import preprocess_text
+from pcm_audio import PcmAudio
+from transcription_pool import transcribe_words
+
+# Speed/accuracy comparison of Whisper models and precisions (fp32, fp16, CPU int8) on one sample chapter. Every
+# configuration transcribes the same decoded audio; the report gives load time, transcription time, real-time
+# factor, word error rate against the chapter's verse text (or the first configuration's transcript when no text
+# is given) and how far word start times drift from the first configuration.
+
+def word_error_rate(reference, hypothesis):
+    # Word-level Levenshtein distance divided by the reference length
+    previous = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, 1):
+        current = [i]
+        for j, hypothesis_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (reference_word != hypothesis_word)))
+        previous = current
+    return previous[-1] / max(1, len(reference))
+
+def timing_drift(baseline, transcript):
+    # Mean |start difference| in ms over the words both transcripts agree on
+    matcher = difflib.SequenceMatcher(None, baseline.words, transcript.words, autojunk=False)
+    diffs = [abs(baseline.start_ms[block.a + k] - transcript.start_ms[block.b + k])
+             for block in matcher.get_matching_blocks() for k in range(block.size)]
+    return sum(diffs) / len(diffs) if diffs else None
+
+def run_configuration(audio, language, whisper_model, whisper_device, whisper_precision):
+    loads_before = model_registry.timings['load_seconds']
+    with contextlib.redirect_stdout(io.StringIO()):
+        model_registry.get_model(whisper_model, whisper_device, whisper_precision)
+        start_time = time.time()
+        transcript = transcribe_words(None, language, whisper_model, whisper_device, whisper_precision, audio=audio)
+        elapsed = time.time() - start_time
+    model_registry.release()
+    return transcript, model_registry.timings['load_seconds'] - loads_before, elapsed
+
+def format_result(whisper_model, whisper_precision, load_seconds, elapsed, duration_ms, word_count, wer, drift):
+    drift_text = '-' if drift is None else f"{drift:.0f}ms"
+    return (f"{whisper_model:<10} {whisper_precision or 'default':<8} {load_seconds:>7.2f}s {elapsed:>9.2f}s "
+            f"{elapsed * 1000 / duration_ms:>6.3f} {word_count:>6} {100 * wer:>6.1f}% {drift_text:>8}")
+
+def main():
+    #*******************PARAMETERS*******************#
+    language = 'es'
+    audio_file = 'audio/esp/PDT/1CO/16.mp3'  # sample chapter, in main's <BOOK>/<chapter>.mp3 layout
+    start_verse = '1co 16:1'  # verse text of the chapter (None = WER against the first configuration)
+    end_verse = '1co 16:24'
+    ebible = 'C:/Users/caleb/Downloads/SPAWTC_palabra_de_dios_para_todos_text/content/chapters'  # same text source as main
+    bible_type = 'xhtml'  # 'ebible'
+    configurations = [  # (whisper_model, whisper_device, whisper_precision); the first is the baseline
+        ('small', 'cpu', 'fp32'),
+        ('small', 'cpu', 'int8'),
+        ('base', 'cpu', 'fp32'),
+        ('base', 'cpu', 'int8'),
+    ]
+    threads = None  # torch CPU threads (None = torch default)
+    output_file = None  # e.g. 'transcription_bench.txt' to keep a copy of the report
+    #************************************************#
+
+    if threads:
+        torch.set_num_threads(threads)
+    reference_words = None
+    if start_verse:
+        verses = ScriptureReference(start_verse, end_verse, bible_filename=ebible, source_type=bible_type).verses
+        reference_words = preprocess_text(' '.join(verse[1] for verse in verses)).split()
+    pcm_audio = PcmAudio.decode(audio_file)
+    audio = pcm_audio.asr_view()
+    duration_ms = len(pcm_audio)
+
+    lines = [
+        f"{audio_file}: {duration_ms / 1000:.1f}s, torch threads {torch.get_num_threads()}, "
+        f"WER against {'verse text' if reference_words else 'first configuration'}",
+        f"{'model':<10} {'precision':<8} {'load':>8} {'transcribe':>10} {'RTF':>6} {'words':>6} {'WER':>7} {'drift':>8}"
+    ]
+    print('\n'.join(lines))
+    baseline = None
+    for whisper_model, whisper_device, whisper_precision in configurations:
+        transcript, load_seconds, elapsed = run_configuration(audio, language, whisper_model, whisper_device,
+                                                              whisper_precision)
+        words = preprocess_text(' '.join(transcript.words)).split()
+        if baseline is None:
+            baseline = transcript
+            if reference_words is None:
+                reference_words = words
+        line = format_result(whisper_model, whisper_precision, load_seconds, elapsed, duration_ms, len(transcript),
+                             word_error_rate(reference_words, words), timing_drift(baseline, transcript))
+        lines.append(line)
+        print(line)
+
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+if __name__ == "__main__":
+    main()
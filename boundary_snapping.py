@@ -0,0 +1,124 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from chunked_transcription import frame_energies
+
+# Verse cut refinement: cut points come from Whisper word times, which can land a few hundred ms inside a word
+# or its breath. Each cut moves to the quietest frame of a short energy envelope within tolerance_ms, when that
+# frame is near the chapter's noise floor. The envelope is averaged over smooth_ms first, so a pause between
+# verses wins over a brief dip inside a word. The quietest frame around every envelope frame is computed once per
+# chapter, so snapping a cut is one array lookup. A chapter split with a PcmReader is never decoded whole: its
+# envelope is taken from the blocks the reader decodes for the verses themselves (see ReaderSnapper).
+
+
+def block_energies(samples, frame_samples):
+    # Energy (dB) of the mono mix of every whole frame_samples frame of an int16 (frames, channels) block
+    samples = samples[:len(samples) - len(samples) % frame_samples]
+    frames = (samples.mean(axis=1, dtype=np.float32) / 32768.0).reshape(-1, frame_samples)
+    return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+
+def energy_envelope(audio_file=None, pcm_audio=None, frame_ms=10, block_frames=16384):
+    # Energy (dB) of every frame_ms frame of the mono mix, from the decoded chapter in blocks of frames, or
+    # streamed from the file when the chapter is not decoded (the ffmpeg and virtual split backends, which
+    # decode nothing else in this process)
+    if pcm_audio is None:
+        return frame_energies(audio_file, frame_ms)
+    frame_samples = pcm_audio.sample_rate * frame_ms // 1000
+    envelope = np.empty(len(pcm_audio.samples) // frame_samples)
+    for block_start in range(0, len(envelope), block_frames):
+        block_end = min(block_start + block_frames, len(envelope))
+        envelope[block_start:block_end] = block_energies(
+            pcm_audio.samples[block_start * frame_samples:block_end * frame_samples], frame_samples)
+    return envelope
+
+
+class BoundarySnapper:
+    # snap(time_ms) gives the refined cut for a time in the chapter, or the time itself when nothing near it is quiet
+    # floor_db overrides the noise floor (the envelope's 10th percentile)
+    def __init__(self, envelope, frame_ms=10, tolerance_ms=250, smooth_ms=50, threshold_db=10, block_frames=16384,
+                 floor_db=None):
+        self.frame_ms = frame_ms
+        envelope = np.asarray(envelope, dtype=np.float64)
+        if len(envelope) == 0:
+            self.snapped_ms = np.empty(0, dtype=np.int64)
+            return
+        smooth = max(1, smooth_ms // frame_ms)
+        padded = np.pad(envelope, (smooth // 2, smooth - 1 - smooth // 2), mode='edge')
+        sums = np.concatenate(([0.0], np.cumsum(padded)))
+        envelope = (sums[smooth:] - sums[:-smooth]) / smooth
+        radius = max(0, tolerance_ms // frame_ms)
+        # Index of the quietest frame within radius of every frame, by blocks of sliding windows so at most
+        # block_frames windows are materialized at once
+        padded = np.pad(envelope, radius, constant_values=np.inf)
+        windows = sliding_window_view(padded, 2 * radius + 1)
+        quietest = np.empty(len(envelope), dtype=np.int64)
+        for block_start in range(0, len(envelope), block_frames):
+            block = slice(block_start, block_start + block_frames)
+            quietest[block] = windows[block].argmin(axis=1)
+        quietest += np.arange(len(envelope)) - radius
+        # Cut time (frame centre) for every frame, or -1 where no frame within reach is quiet
+        if floor_db is None:
+            floor_db = np.percentile(envelope, 10)
+        quiet = envelope[quietest] < floor_db + threshold_db
+        self.snapped_ms = np.where(quiet, quietest * frame_ms + frame_ms // 2, -1)
+
+    def snap(self, time_ms):
+        frame = int(time_ms) // self.frame_ms
+        if 0 <= frame < len(self.snapped_ms) and self.snapped_ms[frame] >= 0:
+            return int(self.snapped_ms[frame])
+        return time_ms
+
+
+class ReaderSnapper:
+    # BoundarySnapper for a chapter read with a PcmReader. Cuts are snapped in time order, each just before the
+    # verse it ends is exported: the reader decodes up to tolerance_ms + smooth_ms past the cut, keeping what it
+    # holds for the verses, and the envelope of every block it decodes is recorded, so snapping decodes nothing
+    # twice. A cut is snapped on the envelope around it, against the noise floor of the envelope decoded so far;
+    # the first cut reads floor_ms ahead so that floor covers more than the first verse. lead_ms (the verse
+    # padding) is decoded before the first cut.
+    def __init__(self, reader, frame_ms=10, tolerance_ms=250, smooth_ms=50, threshold_db=10, lead_ms=0,
+                 floor_ms=30000):
+        self.reader = reader
+        self.frame_ms = frame_ms
+        self.tolerance_ms = tolerance_ms
+        self.smooth_ms = smooth_ms
+        self.threshold_db = threshold_db
+        self.lead_ms = lead_ms
+        self.floor_ms = floor_ms
+        self.frame_samples = reader.sample_rate * frame_ms // 1000
+        # NaN for frames not decoded yet
+        self.envelope = np.full(reader.duration_ms // frame_ms + 1, np.nan)
+        self._pending = None
+        self._snapped = {}
+        reader.on_decode = self._add_frames
+
+    def _add_frames(self, first_frame, frames):
+        # Blocks arrive in decode order; a partial envelope frame is carried into the next block unless the
+        # reader seeked in between
+        if self._pending is not None and self._pending[0] + len(self._pending[1]) == first_frame:
+            first_frame, frames = self._pending[0], np.concatenate((self._pending[1], frames))
+        skip = -first_frame % self.frame_samples
+        first_frame, frames = first_frame + skip, frames[skip:]
+        usable = len(frames) - len(frames) % self.frame_samples
+        self._pending = (first_frame + usable, frames[usable:])
+        index = first_frame // self.frame_samples
+        energies = block_energies(frames[:usable], self.frame_samples)[:len(self.envelope) - index]
+        self.envelope[index:index + len(energies)] = energies
+
+    def snap(self, time_ms):
+        if time_ms not in self._snapped:
+            reach_ms = self.tolerance_ms + self.smooth_ms
+            floor_ms = self.floor_ms if not self._snapped else 0
+            self.reader.read_ahead(time_ms - reach_ms - self.lead_ms, max(time_ms + reach_ms, time_ms + floor_ms))
+            first = max(0, int(time_ms - reach_ms) // self.frame_ms)
+            envelope = self.envelope[first:int(time_ms + reach_ms) // self.frame_ms + 1]
+            decoded = ~np.isnan(envelope)
+            # Frames past the end of the audio are never decoded
+            envelope = envelope[:len(envelope) - np.argmax(decoded[::-1])] if decoded.any() else envelope[:0]
+            if len(envelope) == 0 or np.isnan(envelope).any():
+                self._snapped[time_ms] = time_ms
+            else:
+                snapper = BoundarySnapper(envelope, self.frame_ms, self.tolerance_ms, self.smooth_ms,
+                                          self.threshold_db, floor_db=np.nanpercentile(self.envelope, 10))
+                self._snapped[time_ms] = snapper.snap(time_ms - first * self.frame_ms) + first * self.frame_ms
+        return self._snapped[time_ms]
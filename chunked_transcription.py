@@ -0,0 +1,172 @@
+import os
+import subprocess
+import multiprocessing
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+import model_registry
+
+# Long chapters are transcribed in chunks cut at silences found by a cheap energy VAD pass, so memory and latency
+# per Whisper call are bounded by the chunk length instead of the chapter length. Each chunk is sliced from the
+# chapter's 16 kHz view (or, without one, decoded straight from the source file with ffmpeg), padded by a small
+# overlap on both sides, and only the words whose midpoint falls inside the chunk's own span are kept, which
+# removes the words both neighbours transcribed.
+
+# With workers > 1 the chunks go to worker processes that stay up for the whole run, one pool per
+# (model, device, precision, workers), so each worker loads and warms up its model once rather than per chapter.
+
+SAMPLE_RATE = 16000
+
+_executors = {}
+
+
+def decode_pcm(audio_file, start_ms=None, duration_ms=None, sample_rate=SAMPLE_RATE):
+    # Mono float32 samples of one range of the file at sample_rate (the whole file when start_ms is None)
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error']
+    if start_ms is not None:
+        cmd += ['-ss', f"{start_ms / 1000:.3f}"]
+    cmd += ['-i', audio_file]
+    if duration_ms is not None:
+        cmd += ['-t', f"{duration_ms / 1000:.3f}"]
+    cmd += ['-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-']
+    result = subprocess.run(cmd, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def frame_energies(audio_file, frame_ms=30, sample_rate=SAMPLE_RATE, audio=None):
+    # Energy (dB) of every frame_ms frame, read from an ffmpeg pipe block by block so the decoded chapter is
+    # never held in memory (or taken from audio, an already decoded float32 array at sample_rate)
+    frame_samples = sample_rate * frame_ms // 1000
+    if audio is not None:
+        frames = audio[:len(audio) - len(audio) % frame_samples].reshape(-1, frame_samples)
+        return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+    block_bytes = frame_samples * 2 * 1000
+    process = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', audio_file, '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le',
+         '-ar', str(sample_rate), '-'],
+        stdout=subprocess.PIPE
+    )
+    energies = []
+    remainder = b''
+    while True:
+        block = process.stdout.read(block_bytes)
+        if not block:
+            break
+        block = remainder + block
+        usable = len(block) - len(block) % (frame_samples * 2)
+        remainder = block[usable:]
+        samples = np.frombuffer(block[:usable], np.int16).astype(np.float32) / 32768.0
+        frames = samples.reshape(-1, frame_samples)
+        energies.append(10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10))
+    process.stdout.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {audio_file}")
+    return np.concatenate(energies) if energies else np.zeros(0, np.float32)
+
+
+def find_chunk_boundaries(energies, frame_ms=30, target_chunk_ms=60000, max_chunk_ms=120000, min_silence_ms=300,
+                          threshold_db=10):
+    # Returns chunk cut points in ms, including 0 and the end of the audio. Frames within threshold_db of the
+    # noise floor are silence; each chunk ends in the middle of the silent run closest to target_chunk_ms, or at
+    # the quietest frame before max_chunk_ms when there is no silent run long enough.
+    total_ms = len(energies) * frame_ms
+    if total_ms <= max_chunk_ms:
+        return [0, total_ms]
+
+    silent = energies < np.percentile(energies, 10) + threshold_db
+    min_silence_frames = max(1, min_silence_ms // frame_ms)
+    silence_centres = []
+    run_start = None
+    for i, is_silent in enumerate(np.append(silent, False)):
+        if is_silent and run_start is None:
+            run_start = i
+        elif not is_silent and run_start is not None:
+            if i - run_start >= min_silence_frames:
+                silence_centres.append((run_start + i) // 2 * frame_ms)
+            run_start = None
+
+    boundaries = [0]
+    while total_ms - boundaries[-1] > max_chunk_ms:
+        chunk_start = boundaries[-1]
+        candidates = [c for c in silence_centres if target_chunk_ms // 2 <= c - chunk_start <= max_chunk_ms]
+        if candidates:
+            cut = min(candidates, key=lambda c: abs(c - chunk_start - target_chunk_ms))
+        else:
+            first_frame = (chunk_start + target_chunk_ms) // frame_ms
+            last_frame = (chunk_start + max_chunk_ms) // frame_ms
+            cut = (first_frame + int(np.argmin(energies[first_frame:last_frame]))) * frame_ms
+        boundaries.append(cut)
+    boundaries.append(total_ms)
+    return boundaries
+
+
+def transcribe_chunk(audio_file, chunk_start_ms, chunk_end_ms, overlap_ms, language, whisper_model='small',
+                     whisper_device=None, whisper_precision=None, audio=None):
+    # Words of one chunk as chapter-relative (word, start_ms, end_ms), keeping only those whose midpoint lies
+    # in [chunk_start_ms, chunk_end_ms). audio, when given, is the chunk's already decoded samples including
+    # the overlap.
+    audio_start_ms = max(0, chunk_start_ms - overlap_ms)
+    if audio is None:
+        audio = decode_pcm(audio_file, audio_start_ms, chunk_end_ms + overlap_ms - audio_start_ms)
+    result = model_registry.transcribe(audio, language, whisper_model, whisper_device, whisper_precision,
+                                       word_timestamps=True)
+    words = []
+    for segment in result["segments"]:
+        for word in segment["words"]:
+            start_ms = audio_start_ms + int(word["start"] * 1000)
+            end_ms = audio_start_ms + int(word["end"] * 1000)
+            if chunk_start_ms <= (start_ms + end_ms) // 2 < chunk_end_ms:
+                words.append((word["word"], start_ms, end_ms))
+    return words
+
+
+def _init_chunk_worker(threads, whisper_model, whisper_device, whisper_precision):
+    torch.set_num_threads(threads)
+    model_registry.warm_up(whisper_model, whisper_device, whisper_precision)
+
+
+def get_executor(workers, whisper_model='small', whisper_device=None, whisper_precision=None):
+    key = (*model_registry.resolve_model_key(whisper_model, whisper_device, whisper_precision), workers)
+    if key not in _executors:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"Starting {workers} chunk transcription workers with {threads} threads each")
+        # spawn: forking a process that already started torch thread pools (or CUDA) is unsafe
+        _executors[key] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_chunk_worker,
+            initargs=(threads, *key[:3])
+        )
+    return _executors[key]
+
+
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
+
+
+def transcribe_chunked(audio_file, language, whisper_model='small', whisper_device=None, whisper_precision=None,
+                       target_chunk_ms=60000, max_chunk_ms=120000, overlap_ms=1000, workers=1, audio=None):
+    # Returns chapter-relative (word, start_ms, end_ms) tuples. With workers > 1 chunks are transcribed in
+    # the run's worker processes for this model (see get_executor), each holding its own resident model. audio is the chapter's 16 kHz samples when they
+    # are already decoded; otherwise each chunk is decoded from audio_file.
+    boundaries = find_chunk_boundaries(frame_energies(audio_file, audio=audio), target_chunk_ms=target_chunk_ms,
+                                       max_chunk_ms=max_chunk_ms)
+    # The last boundary is the end of the decoded audio; words past it (rounding) belong to the last chunk
+    boundaries[-1] += overlap_ms
+    print(f"Transcribing {len(boundaries) - 1} chunks cut at silences")
+    samples_per_ms = SAMPLE_RATE // 1000
+    jobs = [
+        (audio_file, chunk_start, chunk_end, overlap_ms, language, whisper_model, whisper_device, whisper_precision,
+         None if audio is None else
+         audio[max(0, chunk_start - overlap_ms) * samples_per_ms:(chunk_end + overlap_ms) * samples_per_ms])
+        for chunk_start, chunk_end in zip(boundaries, boundaries[1:])
+    ]
+    if workers > 1 and len(jobs) > 1:
+        executor = get_executor(workers, whisper_model, whisper_device, whisper_precision)
+        chunk_words = list(executor.map(transcribe_chunk, *zip(*jobs)))
+    else:
+        chunk_words = [transcribe_chunk(*job) for job in jobs]
+    return [word for words in chunk_words for word in words]
@@ -0,0 +1,219 @@
+import math
+import numpy as np
+from transcript import Transcript
+
+# Forced alignment of known verse text against Wav2Vec2 CTC emissions. The chapter's characters are aligned to
+# the emission frames with a Viterbi pass, so there is no autoregressive decoding and no window search.
+#
+# Verses are aligned a group at a time inside an audio window sized from the chapter's frames-per-character
+# rate, keeping the trellis small on long chapters. Every verse of a group except the last is committed, and
+# the next group starts at the last verse's first frame. A wildcard state before the text (first group only)
+# and after it absorbs intro audio and the speech past the group, at a fixed cost per frame below the best
+# token of that frame.
+
+SAMPLE_RATE = 16000
+
+
+def compute_emissions(audio, processor, model, chunk_seconds=30, context_seconds=1, device='cpu'):
+    # (frames, vocab) CTC log-probabilities, computed chunk by chunk so long chapters fit in memory. Frame k
+    # starts at sample k * inputs_to_logits_ratio, as in one pass over the whole chapter: each chunk runs with
+    # context_seconds of audio on both sides and keeps only the frames of its own span, so frames next to a chunk
+    # boundary keep their acoustic context and every chunk stays on the same time grid.
+    import torch
+
+    ratio = model.config.inputs_to_logits_ratio
+    chunk_samples = int(chunk_seconds * SAMPLE_RATE) // ratio * ratio
+    context_samples = int(context_seconds * SAMPLE_RATE) // ratio * ratio
+    emissions = []
+    with torch.no_grad():
+        for chunk_start in range(0, len(audio), chunk_samples):
+            window_start = max(0, chunk_start - context_samples)
+            window = audio[window_start:chunk_start + chunk_samples + context_samples]
+            if len(window) < SAMPLE_RATE // 10:
+                continue
+            inputs = processor(window, sampling_rate=SAMPLE_RATE, return_tensors='pt').input_values.to(device)
+            first_frame = (chunk_start - window_start) // ratio
+            logits = model(inputs).logits[0, first_frame:first_frame + chunk_samples // ratio]
+            emissions.append(torch.log_softmax(logits.float(), dim=-1).cpu().numpy())
+    return np.concatenate(emissions) if emissions else np.zeros((0, model.config.vocab_size), np.float32)
+
+
+def tokenize_verses(verse_texts, vocabulary, word_delimiter='|'):
+    # Returns (tokens, words): tokens is the chapter's token id sequence, words is a list of
+    # (verse_index, word, first_token, end_token). Characters outside the model vocabulary are dropped, so such
+    # words may have no tokens and take their times from their neighbours.
+    delimiter_id = vocabulary.get(word_delimiter)
+    tokens = []
+    words = []
+    for verse_index, verse_text in enumerate(verse_texts):
+        for word in verse_text.split():
+            if tokens and delimiter_id is not None and tokens[-1] != delimiter_id:
+                tokens.append(delimiter_id)
+            first_token = len(tokens)
+            tokens.extend(vocabulary[char] for char in word if char in vocabulary)
+            words.append((verse_index, word, first_token, len(tokens)))
+    return tokens, words
+
+
+def viterbi_align(emissions, tokens, blank_id, leading_wildcard=False, wildcard_penalty=1.0):
+    # Best CTC path of tokens through emissions that ends after the last token and may finish in a trailing
+    # wildcard. Returns (first frame of each token, last frame of each token).
+    frame_count = len(emissions)
+    token_count = len(tokens)
+    if token_count == 0 or frame_count == 0:
+        return None
+
+    # States: [wildcard] blank t1 blank t2 ... blank tN blank wildcard
+    offset = 1 if leading_wildcard else 0
+    state_count = offset + 2 * token_count + 2
+    state_tokens = np.full(state_count, blank_id, dtype=np.int64)
+    state_tokens[offset + 1:offset + 2 * token_count:2] = tokens
+    is_token = np.zeros(state_count, dtype=bool)
+    is_token[offset + 1:offset + 2 * token_count:2] = True
+    wildcards = [state_count - 1] + ([0] if leading_wildcard else [])
+
+    # A token state can be entered from two states back unless that state holds the same token
+    allow_skip = np.zeros(state_count, dtype=bool)
+    allow_skip[2:] = is_token[2:] & (state_tokens[2:] != state_tokens[:-2])
+    if leading_wildcard:
+        allow_skip[2] = True
+    allow_skip[-1] = True  # last token straight into the trailing wildcard
+
+    # Emission score of every state at every frame, wildcards scoring a fixed penalty below the frame's best token
+    state_scores = emissions[:, state_tokens]
+    state_scores[:, wildcards] = (emissions.max(axis=1) - wildcard_penalty)[:, None]
+    skip_penalty = np.where(allow_skip, 0.0, -np.inf)
+
+    scores = np.full(state_count, -np.inf)
+    start_states = 3 if leading_wildcard else 2
+    scores[:start_states] = state_scores[0, :start_states]
+    backpointers = np.zeros((frame_count, state_count), dtype=np.uint8)
+    step = np.full(state_count, -np.inf)
+    skip = np.full(state_count, -np.inf)
+
+    # Backpointer 0 = stay, 1 = from the previous state, 2 = from two states back (ties keep the smaller move)
+    for t in range(1, frame_count):
+        step[1:] = scores[:-1]
+        skip[2:] = scores[:-2] + skip_penalty[2:]
+        choice = backpointers[t]
+        np.greater(step, scores, out=choice, casting='unsafe')
+        best = np.maximum(scores, step)
+        choice[skip > best] = 2
+        np.maximum(best, skip, out=best)
+        scores = best + state_scores[t]
+
+    last_token_state = offset + 2 * token_count - 1
+    state = int(max((last_token_state, last_token_state + 1, state_count - 1), key=lambda s: scores[s]))
+    if not np.isfinite(scores[state]):
+        return None
+
+    first_frames = np.full(token_count, -1, dtype=np.int64)
+    last_frames = np.full(token_count, -1, dtype=np.int64)
+    for t in range(frame_count - 1, -1, -1):
+        if is_token[state]:
+            token = (state - offset - 1) // 2
+            first_frames[token] = t
+            if last_frames[token] < 0:
+                last_frames[token] = t
+        state -= int(backpointers[t, state])
+    return first_frames, last_frames
+
+
+def force_align_verses(emissions, verse_texts, vocabulary, blank_id, frame_ms, word_delimiter='|', group_chars=600,
+                       window_factor=2.0, window_margin_frames=500, wildcard_penalty=1.0):
+    # Returns (transcript, alignment, ratios): a Transcript of the verse words with their aligned times,
+    # (start, end) word ranges per verse in it, and a 0-100 confidence per verse from its tokens' log-probs
+    tokens, words = tokenize_verses(verse_texts, vocabulary, word_delimiter)
+    frame_count = len(emissions)
+    verse_count = len(verse_texts)
+    verse_tokens = [[len(tokens), 0] for _ in range(verse_count)]
+    for verse_index, _, first_token, end_token in words:
+        if end_token > first_token:
+            verse_tokens[verse_index][0] = min(verse_tokens[verse_index][0], first_token)
+            verse_tokens[verse_index][1] = max(verse_tokens[verse_index][1], end_token)
+    frames_per_token = frame_count / max(1, len(tokens))
+
+    first_frames = np.zeros(len(tokens), dtype=np.int64)
+    last_frames = np.zeros(len(tokens), dtype=np.int64)
+    verse_scores = [None] * verse_count
+    verse_index = 0
+    window_start = 0
+    while verse_index < verse_count:
+        # Group verses until the group holds group_chars tokens (at least two verses unless at the end)
+        group_end = verse_index
+        group_tokens = 0
+        while group_end < verse_count and (group_tokens < group_chars or group_end - verse_index < 2):
+            group_tokens += max(0, verse_tokens[group_end][1] - verse_tokens[group_end][0])
+            group_end += 1
+        final_group = group_end == verse_count
+        token_start = min((verse_tokens[v][0] for v in range(verse_index, group_end)
+                           if verse_tokens[v][1] > verse_tokens[v][0]), default=None)
+        token_end = max((verse_tokens[v][1] for v in range(verse_index, group_end)), default=0)
+        if token_start is None:
+            verse_index = group_end
+            continue
+
+        if final_group:
+            window_end = frame_count
+        else:
+            window_end = min(frame_count, window_start + int((token_end - token_start) * frames_per_token * window_factor)
+                             + window_margin_frames)
+        path = viterbi_align(emissions[window_start:window_end], tokens[token_start:token_end], blank_id,
+                             leading_wildcard=window_start == 0, wildcard_penalty=wildcard_penalty)
+        if path is None:
+            # Spread the rest of the text evenly over the rest of the audio; those verses keep a ratio of 0
+            print(f"Warning: CTC alignment failed for verses {verse_index + 1} to {verse_count}")
+            spread = np.linspace(window_start, frame_count, len(tokens) - token_start + 1).astype(np.int64)
+            first_frames[token_start:] = spread[:-1]
+            last_frames[token_start:] = np.maximum(spread[:-1], spread[1:] - 1)
+            break
+        group_first, group_last = path
+        first_frames[token_start:token_end] = group_first + window_start
+        last_frames[token_start:token_end] = group_last + window_start
+        group_emissions = emissions[window_start:window_end]
+
+        commit_end = group_end if final_group else group_end - 1
+        for v in range(verse_index, commit_end):
+            v_start, v_end = verse_tokens[v]
+            if v_end > v_start:
+                frames = group_first[v_start - token_start:v_end - token_start]
+                ids = tokens[v_start:v_end]
+                verse_scores[v] = float(np.mean(group_emissions[frames, ids]))
+        if not final_group:
+            # The next window starts where the uncommitted verse was found (or after the group's last token)
+            uncommitted = [verse_tokens[v][0] for v in range(commit_end, group_end)
+                           if verse_tokens[v][1] > verse_tokens[v][0]]
+            if uncommitted:
+                window_start = int(first_frames[uncommitted[0]])
+            else:
+                window_start = int(last_frames[token_end - 1]) + 1
+            # Leave at least two frames per remaining token (repeated characters need a blank between them)
+            window_start = max(0, min(window_start, frame_count - 2 * (len(tokens) - token_end)))
+        verse_index = commit_end
+
+    transcript = Transcript()
+    alignment = []
+    verse_word_ranges = [[None, None] for _ in range(verse_count)]
+    previous_end_ms = 0
+    for word_index, (verse_index, word, first_token, end_token) in enumerate(words):
+        if end_token > first_token:
+            start_ms = int(first_frames[first_token] * frame_ms)
+            end_ms = int((last_frames[end_token - 1] + 1) * frame_ms)
+        else:
+            start_ms = end_ms = previous_end_ms
+        transcript.append(word, start_ms, max(start_ms, end_ms))
+        previous_end_ms = end_ms
+        if verse_word_ranges[verse_index][0] is None:
+            verse_word_ranges[verse_index][0] = word_index
+        verse_word_ranges[verse_index][1] = word_index + 1
+
+    ratios = []
+    next_start = 0
+    for verse_index, (start, end) in enumerate(verse_word_ranges):
+        if start is None:
+            start = end = next_start
+        alignment.append((start, end))
+        next_start = end
+        score = verse_scores[verse_index]
+        ratios.append(int(round(100 * math.exp(score))) if score is not None and end > start else 0)
+    return transcript, alignment, ratios
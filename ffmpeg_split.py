@@ -0,0 +1,136 @@
+import os
+import bisect
+import subprocess
+from pcm_audio import SEEK_PREROLL_MS
+
+# Verse export with one ffmpeg run per chapter instead of decoding the chapter with pydub and re-encoding every
+# verse. When the verse format is the source's mp3, verses are stream-copied: each cut moves to the mp3 frame
+# boundary nearest the requested time, so the audio keeps the source encoding untouched. A verse whose nearest
+# boundary is more than max_copy_error_ms away from a requested time, and every other output format, is decoded
+# and re-encoded with a sample-accurate cut in the same run, so all formats come from one read of the source.
+# Re-encoded outputs read a second input seeked to just before the run's first re-encoded verse, so a chapter
+# of a whole-book recording is decoded from the chapter, not from the start of the book.
+# A copied verse holds the right frames, but its first frame or two are decoded without the bit reservoir and
+# transform overlap of the frames before them, so their samples (up to about 50 ms) differ from the same stretch
+# of the decoded chapter; the virtual backend avoids this with priming frames (see virtual_split).
+
+# A decoder drops this many samples at the start of an mp3 stream, so a copied frame is heard this much after
+# its timestamp
+MP3_DECODER_DELAY = 529
+# Outputs per ffmpeg command, keeping long chapters (PSA 119) under command-line length limits
+MAX_OUTPUTS_PER_RUN = 64
+
+# Packet listing of the last source file read (the chapters of a whole-book recording share it)
+_packets_cache = {}
+
+
+def read_packets(audio_file):
+    # (codec, sample_rate, packet start times ms, packet end times ms) of the first audio stream, from a remux
+    # to ffmpeg's framemd5 listing (no decoding)
+    stat = os.stat(audio_file)
+    key = (os.path.abspath(audio_file), stat.st_size, stat.st_mtime_ns)
+    if key not in _packets_cache:
+        _packets_cache.clear()
+        _packets_cache[key] = _read_packets(audio_file)
+    return _packets_cache[key]
+
+
+def _read_packets(audio_file):
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', audio_file, '-map', '0:a:0', '-c', 'copy', '-f', 'framemd5', '-'],
+        capture_output=True, text=True, check=True
+    )
+    codec = None
+    sample_rate = None
+    time_base = None
+    starts = []
+    ends = []
+    for line in result.stdout.splitlines():
+        if line.startswith('#tb 0:'):
+            numerator, denominator = line.split(':', 1)[1].strip().split('/')
+            time_base = 1000 * int(numerator) / int(denominator)
+        elif line.startswith('#codec_id 0:'):
+            codec = line.split(':', 1)[1].strip()
+        elif line.startswith('#sample_rate 0:'):
+            sample_rate = int(line.split(':', 1)[1])
+        elif line and not line.startswith('#'):
+            fields = line.split(',')
+            pts, duration = int(fields[2]), int(fields[3])
+            starts.append(pts * time_base)
+            ends.append((pts + duration) * time_base)
+    return codec, sample_rate, starts, ends
+
+
+def nearest_index(values, target):
+    index = bisect.bisect_left(values, target)
+    if index == len(values) or (index > 0 and target - values[index - 1] <= values[index] - target):
+        index -= 1
+    return index
+
+
+def plan_copy_cut(heard_starts, packet_ends, start_ms, end_ms):
+    # (first packet, last packet, heard start ms, heard end ms) of the frame-aligned cut closest to the request.
+    # The file's final packet is never copied: it carries the end-trim side data, and a copy holding it is
+    # decoded with a wrong start skip.
+    first = nearest_index(heard_starts[:-1], start_ms)
+    last = max(first, nearest_index(packet_ends[:-1], end_ms))
+    return first, last, heard_starts[first], packet_ends[last]
+
+
+def export_segments(audio_file, segments, max_copy_error_ms=20, codec_options=None):
+    # segments: (start_ms, end_ms, output paths) per verse, the format of each file following its extension;
+    # codec_options maps a format to extra ffmpeg output arguments. Returns the (start_ms, end_ms) each verse's
+    # files actually hold: the frame-aligned times when its mp3 is stream-copied (its other formats are cut at
+    # the same times), the requested times otherwise. Copied frames keep their times, not their exact samples at
+    # the verse start (see above).
+    codec_options = codec_options or {}
+    codec, sample_rate, packet_starts, packet_ends = read_packets(audio_file)
+    copy_allowed = codec == 'mp3' and not codec_options.get('mp3') and len(packet_starts) > 1 and max_copy_error_ms > 0
+    if copy_allowed:
+        delay_ms = 1000 * MP3_DECODER_DELAY / sample_rate
+        heard_starts = [packet_start + delay_ms for packet_start in packet_starts]
+
+    outputs = []
+    exported_times = []
+    copied = 0
+    for start_ms, end_ms, output_paths in segments:
+        copy = None
+        if copy_allowed and any(os.path.splitext(path)[1] == '.mp3' for path in output_paths):
+            first, last, copy_start_ms, copy_end_ms = plan_copy_cut(heard_starts, packet_ends, start_ms, end_ms)
+            if abs(copy_start_ms - start_ms) <= max_copy_error_ms and abs(copy_end_ms - end_ms) <= max_copy_error_ms:
+                copy = first, last
+                start_ms, end_ms = copy_start_ms, copy_end_ms
+                copied += 1
+        for output_path in output_paths:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            output_format = os.path.splitext(output_path)[1][1:]
+            if copy is not None and output_format == 'mp3':
+                # ffmpeg keeps the packets with pts in [-ss, -to); cut half a packet inside the boundaries
+                first, last = copy
+                output = ['-map', '0:a:0']
+                if first > 0:
+                    output += ['-ss', f"{(packet_starts[first - 1] + packet_starts[first]) / 2000:.6f}"]
+                output += ['-to', f"{(packet_starts[last] + packet_ends[last]) / 2000:.6f}", '-c:a', 'copy',
+                           output_path]
+                outputs.append((None, output))
+            else:
+                outputs.append((start_ms, [end_ms, *codec_options.get(output_format, []), output_path]))
+        exported_times.append((int(round(start_ms)), int(round(end_ms))))
+
+    for run_start in range(0, len(outputs), MAX_OUTPUTS_PER_RUN):
+        run = outputs[run_start:run_start + MAX_OUTPUTS_PER_RUN]
+        command = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', audio_file]
+        decode_starts = [start_ms for start_ms, _ in run if start_ms is not None]
+        if decode_starts:
+            seek_ms = max(0, min(decode_starts) - SEEK_PREROLL_MS)
+            command += ['-ss', f"{seek_ms / 1000:.3f}", '-i', audio_file]
+        for start_ms, output in run:
+            if start_ms is None:
+                command += output
+            else:
+                end_ms, *output = output
+                command += ['-map', '1:a:0', '-ss', f"{(start_ms - seek_ms) / 1000:.3f}",
+                            '-to', f"{(end_ms - seek_ms) / 1000:.3f}", *output]
+        subprocess.run(command, check=True)
+    print(f"ffmpeg split: {copied} verses stream-copied, {len(segments) - copied} re-encoded")
+    return exported_times
@@ -36,7 +36,11 @@ def generate_normalized_score_report(pdt_folder, threshold, output_file, xhtml_d
                         # Read and process the txt file
                         with open(txt_file, 'r') as f:
                             for line in f:
-                                verse, score = line.strip().split(': ')
+                                # Search counters are logged as '#' comments after the ratio
+                                line = line.split('#')[0].strip()
+                                if not line:
+                                    continue
+                                verse, score = line.split(': ')
                                 score = int(score)
                                 verse_text = verses_dict.get(verse, "")
                                 verse_length = len(verse_text.split())
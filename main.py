@@ -1,68 +1,142 @@
 import os
-import whisper
-from pydub import AudioSegment
+from pydub.utils import mediainfo
 from ScriptureReference import ScriptureReference
 from fuzzywuzzy import fuzz
+from transcript import Transcript, as_transcript
+from window_scorer import BatchWindowScorer, new_search_counters, ratio_upper_bound
+import model_registry
+from transcript_cache import get_transcript_cache
+from chunked_transcription import shutdown_executors, SAMPLE_RATE
+from transcription_pool import TranscriptionPool, transcribe_words
+from batched_transcription import BatchedTranscriber
+from pcm_audio import PcmAudio, PcmReader, decode_asr_audio
+from ffmpeg_split import export_segments
+from virtual_split import write_chapter
+from boundary_snapping import energy_envelope, BoundarySnapper, ReaderSnapper
+from ctc_alignment import compute_emissions, force_align_verses
 import re
+import json
+import math
+import threading
+import subprocess
+import bisect
 import time
 import torch
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def transcribe_audio_with_timestamps(audio_file, language):
+visualization_threads = []
+
+def transcript_cache_entry(audio_file, language, whisper_model='small', whisper_device=None, whisper_precision=None,
+                           transcript_cache_dir=None, transcript_cache_max_mb=1024, transcription_chunk_ms=None,
+                           chunk_overlap_ms=1000, skip_non_speech=False, transcription_batch_size=1):
+    # (cache, key, key fields) for a chapter's transcript, or (None, None, None) when caching is off
+    if not transcript_cache_dir:
+        return None, None, None
+    decode_options = {'word_timestamps': True}
+    if transcription_chunk_ms:
+        decode_options.update(chunk_ms=transcription_chunk_ms, chunk_overlap_ms=chunk_overlap_ms)
+    if skip_non_speech:
+        decode_options['skip_non_speech'] = True
+    if transcription_batch_size > 1:
+        # Batched windows are decoded without the previous window's text as a prompt
+        decode_options['batched'] = True
+    cache = get_transcript_cache(transcript_cache_dir, transcript_cache_max_mb * 1024 * 1024)
+    _, _, precision = model_registry.resolve_model_key(whisper_model, whisper_device, whisper_precision)
+    cache_key, key_fields = cache.make_key(audio_file, whisper_model, model_registry.model_version(whisper_model),
+                                           language, dict(decode_options, precision=precision))
+    return cache, cache_key, key_fields
+
+def transcribe_audio_with_timestamps(audio_file, language, whisper_model='small', whisper_device=None,
+                                     whisper_precision=None, transcript_cache_dir=None, transcript_cache_max_mb=1024,
+                                     transcription_chunk_ms=None, chunk_overlap_ms=1000, transcription_workers=1,
+                                     transcription_pool=None, pcm_audio=None, skip_non_speech=False,
+                                     transcription_batch_size=1):
+    # pcm_audio: the chapter already decoded by process_single_file; Whisper reads its 16 kHz view instead of
+    # decoding the file again (pool workers decode the same view in their own process)
     print("Transcribing audio with timestamps using Whisper...")
-    
-    # Set the device to the first CUDA device (usually your NVIDIA GPU)
-    # device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-    # if torch.cuda.is_available():
-    #     print(f"Using GPU: {torch.cuda.get_device_name(0)}")
-    # else:
-    #     print("Using CPU")
-
-    # # Load the Whisper model on the specified device
-    # model = whisper.load_model("small", device=device)
-    model = whisper.load_model("small")
-    result = model.transcribe(audio_file, language=language, word_timestamps=True)
-    
-    transcribed_words = []
-    for segment in result["segments"]:
-        for word in segment["words"]:
-            transcribed_words.append({
-                "word": word["word"].strip().lower(),
-                "start": int(word["start"] * 1000),
-                "end": int(word["end"] * 1000)
-            })
+
+    cache, cache_key, key_fields = transcript_cache_entry(audio_file, language, whisper_model, whisper_device,
+                                                          whisper_precision, transcript_cache_dir,
+                                                          transcript_cache_max_mb, transcription_chunk_ms,
+                                                          chunk_overlap_ms, skip_non_speech, transcription_batch_size)
+    if cache is not None:
+        transcribed_words = cache.get(cache_key)
+        if transcribed_words is not None:
+            print(f"Loaded cached transcript for {audio_file}. Total words: {len(transcribed_words)}")
+            return transcribed_words
+
+    transcription_options = {
+        'whisper_model': whisper_model,
+        'whisper_device': whisper_device,
+        'whisper_precision': whisper_precision,
+        'transcription_chunk_ms': transcription_chunk_ms,
+        'chunk_overlap_ms': chunk_overlap_ms,
+        'transcription_workers': transcription_workers,
+        'skip_non_speech': skip_non_speech,
+    }
+    if transcription_pool is not None:
+        transcribed_words = transcription_pool.transcribe(audio_file, language, **transcription_options)
+    elif pcm_audio is not None:
+        transcribed_words = transcribe_words(audio_file, language, audio=pcm_audio.asr_view(),
+                                             **transcription_options)
+        pcm_audio.release_asr_view()
+    else:
+        transcribed_words = transcribe_words(audio_file, language, **transcription_options)
     
     print(f"Transcription complete. Total words: {len(transcribed_words)}")
     # Print full transcription as string
-    print(' '.join([w['word'] for w in transcribed_words]))
-    
+    print(transcribed_words.text)
+
+    if cache is not None:
+        cache.put(cache_key, key_fields, transcribed_words)
 
     return transcribed_words
 
+def prefetch_transcriptions(audio_files, language, transcription_pool=None, alignment_method='window',
+                            whisper_model='small', whisper_device=None, whisper_precision=None,
+                            transcript_cache_dir=None, transcript_cache_max_mb=1024, transcription_chunk_ms=None,
+                            chunk_overlap_ms=1000, transcription_workers=1, skip_non_speech=False,
+                            transcription_batch_size=1, **options):
+    # Queues every uncached chapter on the transcription pool so the workers stay busy while chapters are
+    # aligned and split one by one
+    if transcription_pool is None or alignment_method == 'ctc':
+        return
+    for audio_file in audio_files:
+        if not os.path.exists(audio_file):
+            continue
+        cache, cache_key, _ = transcript_cache_entry(audio_file, language, whisper_model, whisper_device,
+                                                     whisper_precision, transcript_cache_dir,
+                                                     transcript_cache_max_mb, transcription_chunk_ms,
+                                                     chunk_overlap_ms, skip_non_speech, transcription_batch_size)
+        if cache is not None and cache.contains(cache_key):
+            continue
+        transcription_pool.prefetch(audio_file, language, whisper_model=whisper_model, whisper_device=whisper_device,
+                                    whisper_precision=whisper_precision, transcription_chunk_ms=transcription_chunk_ms,
+                                    chunk_overlap_ms=chunk_overlap_ms, transcription_workers=transcription_workers,
+                                    skip_non_speech=skip_non_speech)
+
 def preprocess_text(text):
     return re.sub(r'\W+', ' ', text.lower()).strip()
 
-def visualize_alignment(visualization_data, output_folder, context_size=20):
+def visualize_alignment(alignment_records, transcribed_words, output_folder, context_size=20):
+    transcribed_words = as_transcript(transcribed_words)
     visualization = []
-    for data in visualization_data:
-        verse_ref = data['verse_ref']
+    for data in alignment_records:
         verse_text = data['verse_text']
         start_window = data['start_window']
         end_window = data['end_window']
         best_start = data['best_start']
         best_end = data['best_end']
-        transcribed_words = data['transcribed_words']
 
         # Get context around the aligned portion
         context_start = max(0, start_window - context_size)
         context_end = min(len(transcribed_words), end_window + context_size)
-        context_words = transcribed_words[context_start:context_end]
-        context = ' '.join([w['word'] for w in context_words])
+        context = transcribed_words.join(context_start, context_end)
 
-        # Calculate character positions
-        char_positions = [0]
-        for word in context_words:
-            char_positions.append(char_positions[-1] + len(word['word']) + 1)  # +1 for space
+        # Calculate character positions relative to the start of the context
+        word_offsets = transcribed_words.char_offsets
+        char_positions = [word_offsets[k] - word_offsets[context_start] for k in range(context_start, context_end + 1)]
 
         # Calculate relative positions for visualization
         rel_start_window = char_positions[start_window - context_start] if start_window >= context_start else 0
@@ -87,28 +161,94 @@ def visualize_alignment(visualization_data, output_folder, context_size=20):
         ])
 
     # Save visualization to file
-    book_name = visualization_data[0]['verse_ref'].split('_')[0]
-    book_number = ScriptureReference.get_book_number(book_name)
-    numbered_book_name = f"{book_number:02d}_{book_name}"
-    vis_file_path = os.path.join(output_folder, f"{numbered_book_name}_alignment_visualization.txt")
+    book_name = alignment_records[0]['verse_ref'].split('_')[0]
+    vis_file_path = os.path.join(output_folder, f"{get_numbered_book_name(book_name)}_alignment_visualization.txt")
     os.makedirs(os.path.dirname(vis_file_path), exist_ok=True)
     with open(vis_file_path, 'w', encoding='utf-8') as f:
         f.write('\n'.join(visualization))
 
     print(f"Alignment visualization saved to: {vis_file_path}")
 
-def align_verses(transcribed_words, verses, book_name, output_folder, extension_percentage=300):
-    alignment = []
-    visualization_data = []
+def get_numbered_book_name(book_name):
+    return f"{ScriptureReference.get_book_number(book_name):02d}_{book_name}"
+
+def save_alignment_records(alignment_records, transcribed_words, book_name, output_folder):
+    # Compact per-verse records plus the transcript, enough to render the visualization later
+    numbered_book_name = get_numbered_book_name(book_name)
+    os.makedirs(output_folder, exist_ok=True)
+    records_path = os.path.join(output_folder, f"{numbered_book_name}_alignment_records.json")
+    with open(records_path, 'w', encoding='utf-8') as f:
+        json.dump(alignment_records, f, ensure_ascii=False)
+    as_transcript(transcribed_words).save(os.path.join(output_folder, f"{numbered_book_name}_transcript.bin"))
+
+def schedule_visualization(alignment_records, transcribed_words, output_folder, visualization='sync'):
+    # 'sync' renders now, 'background' renders in a writer thread, 'off' only keeps the stored records
+    if visualization == 'sync':
+        visualize_alignment(alignment_records, transcribed_words, output_folder)
+    elif visualization == 'background':
+        thread = threading.Thread(target=visualize_alignment, args=(alignment_records, transcribed_words, output_folder))
+        thread.start()
+        visualization_threads.append(thread)
+
+def wait_for_visualizations():
+    while visualization_threads:
+        visualization_threads.pop().join()
+
+def render_visualizations(output_folder):
+    # Regenerates alignment visualizations from stored records, e.g. after a run with visualization='off'
+    for root, dirs, files in os.walk(output_folder):
+        for file in files:
+            if not file.endswith('_alignment_records.json'):
+                continue
+            numbered_book_name = file[:-len('_alignment_records.json')]
+            transcript_path = os.path.join(root, f"{numbered_book_name}_transcript.bin")
+            if not os.path.exists(transcript_path):
+                print(f"Transcript not found for {os.path.join(root, file)}. Skipping.")
+                continue
+            with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
+                alignment_records = json.load(f)
+            if alignment_records:
+                visualize_alignment(alignment_records, Transcript.load(transcript_path), root)
+
+def align_verses(transcribed_words, verses, book_name, output_folder, extension_percentage=300, scorer='fuzz',
+                 min_length_ratio=None, max_length_ratio=None, adaptive=False, adaptive_threshold=80,
+                 adaptive_extensions=(25, 100), visualization='sync'):
+    transcribed_words = as_transcript(transcribed_words)
     total_chars = sum(len(verse[1]) for verse in verses)
     total_transcribed_words = len(transcribed_words)
 
     print(f"Total words in transcribed audio: {total_transcribed_words}")
     print(f"Total characters in verses: {total_chars}")
     print(f"Search window extension: {extension_percentage}%")
+    print(f"Window scorer: {scorer}")
+    print(f"Window length ratio limits: {min_length_ratio} to {max_length_ratio}")
+    if adaptive:
+        print(f"Adaptive windows: {adaptive_extensions}% from previous verse end, escalating below ratio {adaptive_threshold}")
+
+    records = search_verse_windows(transcribed_words, verses, extension_percentage, scorer,
+                                   min_length_ratio, max_length_ratio, adaptive=adaptive,
+                                   adaptive_threshold=adaptive_threshold, adaptive_extensions=adaptive_extensions)
+    return collect_alignment(records, transcribed_words, book_name, output_folder, visualization=visualization)
+
+def search_verse_windows(transcribed_words, verses, extension_percentage=300, scorer='fuzz',
+                         min_length_ratio=None, max_length_ratio=None, double_first_extension=True,
+                         adaptive=False, adaptive_threshold=80, adaptive_extensions=(25, 100)):
+    # Searches each verse in a window around its proportional position within transcribed_words and
+    # returns one record per verse (window bounds, best bounds, ratio and search counters).
+    # In adaptive mode each verse is first searched in tight windows starting at the previous verse's end,
+    # widening through adaptive_extensions and finally the proportional window while the best ratio stays
+    # below adaptive_threshold.
+    records = []
+    transcribed_words = as_transcript(transcribed_words)
+    total_chars = sum(len(verse[1]) for verse in verses) or 1
+    total_transcribed_words = len(transcribed_words)
+
+    window_scorer = BatchWindowScorer(transcribed_words) if scorer == 'batch' else None
+
+    # Char position where each transcribed word starts in the space-joined transcript
+    word_offsets = transcribed_words.char_offsets
 
     cumulative_chars = 0
-    fuzzy_ratios = []
 
     for verse_index, verse in enumerate(verses):
         verse_text = preprocess_text(verse[1])
@@ -125,7 +265,7 @@ def align_verses(transcribed_words, verses, book_name, output_folder, extension_
         # Calculate search window
         window_size = expected_end - expected_start
         extension = int(window_size * (extension_percentage / 100))
-        if verse_index == 0:
+        if verse_index == 0 and double_first_extension:
             extension *= 2  # Double extension for the first verse
 
         start_window = max(0, expected_start - extension)
@@ -137,125 +277,763 @@ def align_verses(transcribed_words, verses, book_name, output_folder, extension_
         if end_window == total_transcribed_words:
             start_window = max(0, start_window - (end_window - expected_end))
 
+        search_windows = []
+        if adaptive and records and records[-1]['best_end'] is not None:
+            previous_end = records[-1]['best_end']
+            for adaptive_extension in adaptive_extensions:
+                adaptive_size = max(window_size, 1)
+                adaptive_extension_words = max(1, int(adaptive_size * (adaptive_extension / 100)))
+                search_windows.append((
+                    max(0, previous_end - adaptive_extension_words),
+                    min(total_transcribed_words, previous_end + adaptive_size + adaptive_extension_words + 1)
+                ))
+        search_windows.append((start_window, end_window))
+
         print(f"\nAligning Verse {verse[0]}:")
         print(f"Expected start: {expected_start}, Expected end: {expected_end}")
-        print(f"Search window: {start_window} to {end_window}")
 
         best_ratio = 0
-        best_start_index = start_window
-        best_end_index = min(start_window + window_size, end_window)
-
-        for start in range(start_window, end_window - 1):
-            for end in range(start + 1, end_window):
-                window = ' '.join([w['word'] for w in transcribed_words[start:end]])
-                ratio = fuzz.ratio(window, verse_text)
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_start_index = start
-                    best_end_index = end
+        best_start_index = None
+        best_end_index = None
+        counters = new_search_counters()
+        escalations = -1
+        for start_window, end_window in search_windows:
+            escalations += 1
+            print(f"Search window: {start_window} to {end_window}")
+            ratio, start, end, window_counters = find_best_window(
+                transcribed_words, word_offsets, verse_text, start_window, end_window,
+                window_scorer, min_length_ratio, max_length_ratio)
+            for key in counters:
+                counters[key] += window_counters[key]
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_start_index = start
+                best_end_index = end
+            if best_ratio >= adaptive_threshold:
+                break
 
         if best_ratio == 0:
             print("No good match found. Using expected positions.")
             best_start_index = expected_start
             best_end_index = expected_end
 
-        alignment.append((best_start_index, best_end_index))
         cumulative_chars += verse_char_count
 
-        aligned_text = ' '.join([w['word'] for w in transcribed_words[best_start_index:best_end_index]])
+        aligned_text = transcribed_words.join(best_start_index, best_end_index)
         print(f"Best ratio: {best_ratio}")
         print(f"Aligned text: {aligned_text}")
         print(f"Actual text: {verse_text}")
+        print(f"Windows scored: {counters['scored']} of {counters['candidates']}")
+        if adaptive:
+            print(f"Window escalations: {escalations}")
         print("-" * 80)
 
-        fuzzy_ratios.append(f"{verse[0]}: {best_ratio}")
-        
-        # Store visualization data
-        visualization_data.append({
+        record = {
             'verse_ref': verse[0],
             'verse_text': verse_text,
             'start_window': start_window,
             'end_window': end_window,
             'best_start': best_start_index,
             'best_end': best_end_index,
-            'transcribed_words': transcribed_words
-        })
+            'best_ratio': best_ratio,
+            'counters': counters
+        }
+        if adaptive:
+            record['escalations'] = escalations
+        records.append(record)
 
-        # In the align_verses function, just before appending to visualization_data
         print(f"Debug - Verse {verse[0]}:")
         print(f"Start window: {start_window}, End window: {end_window}")
         print(f"Best start: {best_start_index}, Best end: {best_end_index}")
         print(f"Aligned text: {aligned_text}")
 
-    book_number = ScriptureReference.get_book_number(book_name)
-    numbered_book_name = f"{book_number:02d}_{book_name}"
-    fuzzy_file_path = os.path.join(output_folder, f"{numbered_book_name}_fuzzy_ratios.txt")
+    return records
+
+def find_best_window(transcribed_words, word_offsets, verse_text, start_window, end_window, window_scorer=None,
+                     min_length_ratio=None, max_length_ratio=None):
+    # Best scoring (start, end) inside [start_window, end_window); (0, None, None, counters) if nothing matched
+    verse_char_count = len(verse_text)
+    min_window_length = min_length_ratio * verse_char_count if min_length_ratio else 0
+    max_window_length = max_length_ratio * verse_char_count if max_length_ratio else word_offsets[-1]
+
+    if window_scorer:
+        return window_scorer.best_window(verse_text, start_window, end_window, min_window_length, max_window_length)
+
+    best_ratio = 0
+    best_start_index = None
+    best_end_index = None
+    counters = new_search_counters()
+    for start in range(start_window, end_window - 1):
+        for end in range(start + 1, end_window):
+            counters['candidates'] += 1
+            window_length = word_offsets[end] - 1 - word_offsets[start]
+            if window_length < min_window_length:
+                counters['pruned_length'] += 1
+                continue
+            if window_length > max_window_length:
+                counters['candidates'] += end_window - end - 1
+                counters['pruned_length'] += end_window - end
+                break
+            if ratio_upper_bound(window_length, verse_char_count) <= best_ratio:
+                # Past the verse length the bound only shrinks as the window grows
+                if window_length >= verse_char_count:
+                    counters['candidates'] += end_window - end - 1
+                    counters['pruned_bound'] += end_window - end
+                    break
+                counters['pruned_bound'] += 1
+                continue
+            counters['scored'] += 1
+            window = transcribed_words.join(start, end)
+            ratio = fuzz.ratio(window, verse_text)
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_start_index = start
+                best_end_index = end
+
+    return best_ratio, best_start_index, best_end_index, counters
+
+def collect_alignment(records, transcribed_words, book_name, output_folder, summary_lines=(), visualization='sync'):
+    # Turns per-verse search records into the (start, end) alignment, writes the fuzzy ratio log and
+    # stores compact alignment records that the visualization is rendered from
+    alignment = []
+    fuzzy_ratios = []
+    alignment_records = []
+    total_counters = new_search_counters()
+    total_escalations = 0
+
+    for record in records:
+        alignment.append((record['best_start'], record['best_end']))
+
+        counters = record.get('counters')
+        if counters:
+            for key in total_counters:
+                total_counters[key] += counters[key]
+            notes = format_search_counters(counters)
+            if 'escalations' in record:
+                total_escalations += record['escalations']
+                notes += f" escalations={record['escalations']}"
+            fuzzy_ratios.append(f"{record['verse_ref']}: {record['best_ratio']}  # {notes}")
+        else:
+            fuzzy_ratios.append(f"{record['verse_ref']}: {record['best_ratio']}")
+
+        alignment_records.append({
+            'verse_ref': record['verse_ref'],
+            'verse_text': record['verse_text'],
+            'start_window': record['start_window'],
+            'end_window': record['end_window'],
+            'best_start': record['best_start'],
+            'best_end': record['best_end'],
+            'best_ratio': record['best_ratio']
+        })
+
+    if any(record.get('counters') for record in records):
+        notes = format_search_counters(total_counters)
+        if any('escalations' in record for record in records):
+            notes += f" escalations={total_escalations}"
+        fuzzy_ratios.append(f"# total: {notes}")
+        print(f"Windows scored: {total_counters['scored']} of {total_counters['candidates']}")
+    fuzzy_ratios.extend(f"# {line}" for line in summary_lines)
+
+    write_fuzzy_ratios(fuzzy_ratios, book_name, output_folder)
+
+    save_alignment_records(alignment_records, transcribed_words, book_name, output_folder)
+    schedule_visualization(alignment_records, transcribed_words, output_folder, visualization)
+
+    return alignment
+
+def format_search_counters(counters):
+    return (f"scored={counters['scored']} candidates={counters['candidates']} "
+            f"pruned_bound={counters['pruned_bound']} pruned_length={counters['pruned_length']}")
+
+def write_fuzzy_ratios(fuzzy_ratios, book_name, output_folder):
+    fuzzy_file_path = os.path.join(output_folder, f"{get_numbered_book_name(book_name)}_fuzzy_ratios.txt")
     os.makedirs(os.path.dirname(fuzzy_file_path), exist_ok=True)
     with open(fuzzy_file_path, 'w', encoding='utf-8') as f:
         f.write('\n'.join(fuzzy_ratios))
 
-    visualize_alignment(visualization_data, output_folder)
+def align_verses_dp(transcribed_words, verses, book_name, output_folder, miss_penalty=0.5, noise_penalty=0.3,
+                    visualization='sync'):
+    # Monotonic DTW over (transcript word, verse) states: every word is either leading noise,
+    # part of exactly one verse (in order, each verse at least one word) or trailing noise.
+    # Runs in O(words * verses) instead of scoring every (start, end) window per verse.
+    transcribed_words = as_transcript(transcribed_words)
+    # Normalized like the verse text, so words with punctuation attached ('tierra.') still match
+    words = [preprocess_text(word) for word in transcribed_words.words]
+    total_transcribed_words = len(transcribed_words)
+    verse_count = len(verses)
 
-    
+    print(f"Total words in transcribed audio: {total_transcribed_words}")
+    print(f"Total verses: {verse_count}")
+    print("Alignment method: dp")
 
-    return alignment
+    if total_transcribed_words < verse_count:
+        print("Fewer transcribed words than verses. Falling back to window search.")
+        return align_verses(transcribed_words, verses, book_name, output_folder, visualization=visualization)
+
+    verse_texts = [preprocess_text(verse[1]) for verse in verses]
+    verse_tokens = [set(text.split()) for text in verse_texts]
+
+    # Words shared by many verses ('and', 'the', ...) carry little information about boundaries
+    document_frequency = {}
+    for tokens in verse_tokens:
+        for token in tokens:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    verse_weights = [
+        {token: math.log(1 + verse_count / document_frequency[token]) for token in tokens}
+        for tokens in verse_tokens
+    ]
+
+    # State 0 is leading noise, states 1..verse_count are verses, verse_count + 1 is trailing noise
+    state_count = verse_count + 2
+    trailing_state = verse_count + 1
+    negative_infinity = float('-inf')
+
+    def emission(word, state):
+        if state == 0 or state == trailing_state:
+            return -noise_penalty
+        return verse_weights[state - 1].get(word, -miss_penalty)
+
+    first_word = words[0]
+    scores = [negative_infinity] * state_count
+    scores[0] = emission(first_word, 0)
+    scores[1] = emission(first_word, 1)
+
+    # advanced[j][s] is 1 when word j entered state s from state s - 1
+    advanced = [bytearray(state_count)]
+    for j in range(1, total_transcribed_words):
+        word = words[j]
+        new_scores = [negative_infinity] * state_count
+        moves = bytearray(state_count)
+        for state in range(min(state_count, j + 2)):
+            stay = scores[state]
+            advance = scores[state - 1] if state > 0 else negative_infinity
+            if advance > stay:
+                new_scores[state] = advance + emission(word, state)
+                moves[state] = 1
+            elif stay != negative_infinity:
+                new_scores[state] = stay + emission(word, state)
+        scores = new_scores
+        advanced.append(moves)
+
+    state = trailing_state if scores[trailing_state] > scores[verse_count] else verse_count
+    word_states = [0] * total_transcribed_words
+    for j in range(total_transcribed_words - 1, -1, -1):
+        word_states[j] = state
+        if j > 0 and advanced[j][state]:
+            state -= 1
+
+    verse_starts = [None] * verse_count
+    verse_ends = [None] * verse_count
+    for j, state in enumerate(word_states):
+        if 0 < state < trailing_state:
+            if verse_starts[state - 1] is None:
+                verse_starts[state - 1] = j
+            verse_ends[state - 1] = j + 1
+
+    records = []
+    for verse_index, verse in enumerate(verses):
+        verse_text = verse_texts[verse_index]
+        best_start_index = verse_starts[verse_index]
+        best_end_index = verse_ends[verse_index]
+        aligned_text = transcribed_words.join(best_start_index, best_end_index)
+        best_ratio = fuzz.ratio(aligned_text, verse_text)
+
+        records.append({
+            'verse_ref': verse[0],
+            'verse_text': verse_text,
+            'start_window': best_start_index,
+            'end_window': best_end_index,
+            'best_start': best_start_index,
+            'best_end': best_end_index,
+            'best_ratio': best_ratio
+        })
+
+        print(f"\nAligned Verse {verse[0]}: {best_start_index} to {best_end_index}")
+        print(f"Ratio: {best_ratio}")
+        print(f"Aligned text: {aligned_text}")
+        print(f"Actual text: {verse_text}")
+        print("-" * 80)
+
+    return collect_alignment(records, transcribed_words, book_name, output_folder, visualization=visualization)
+
+def align_verses_anchored(transcribed_words, verses, book_name, output_folder, ngram_size=3, workers=1,
+                          extension_percentage=300, scorer='fuzz', min_length_ratio=None, max_length_ratio=None,
+                          adaptive=False, adaptive_threshold=80, adaptive_extensions=(25, 100),
+                          visualization='sync'):
+    # Splits the chapter at exact n-gram anchors and runs the window search on each segment on its own,
+    # so one bad region (an intro, skipped text) cannot pull the proportional windows of the whole chapter
+    transcribed_words = as_transcript(transcribed_words)
+    total_transcribed_words = len(transcribed_words)
+
+    print(f"Total words in transcribed audio: {total_transcribed_words}")
+    print(f"Total verses: {len(verses)}")
+    print(f"Alignment method: anchored ({ngram_size}-gram anchors)")
+
+    anchors = find_ngram_anchors(transcribed_words, verses, ngram_size)
+    segments = anchor_segments(anchors, len(verses), total_transcribed_words)
+    print(f"Anchored verses: {len(anchors)}, segments: {len(segments)}")
+
+    # Anchor starts are estimates, so segments overlap their neighbours by a few words
+    segments = [
+        (verse_start, verse_end, max(0, word_start - ngram_size), min(total_transcribed_words, word_end + ngram_size))
+        for verse_start, verse_end, word_start, word_end in segments
+    ]
+    jobs = [
+        (transcribed_words[word_start:word_end], verses[verse_start:verse_end], extension_percentage, scorer,
+         min_length_ratio, max_length_ratio, word_start == 0, adaptive, adaptive_threshold, adaptive_extensions)
+        for verse_start, verse_end, word_start, word_end in segments
+    ]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            segment_records = list(executor.map(search_verse_windows, *zip(*jobs)))
+    else:
+        segment_records = [search_verse_windows(*job) for job in jobs]
+
+    records = []
+    for (verse_start, verse_end, word_start, word_end), segment in zip(segments, segment_records):
+        for record in segment:
+            for key in ('start_window', 'end_window', 'best_start', 'best_end'):
+                record[key] += word_start
+            records.append(record)
+
+    summary_lines = [f"anchors={len(anchors)} segments={len(segments)}"]
+    return collect_alignment(records, transcribed_words, book_name, output_folder, summary_lines, visualization)
+
+def find_ngram_anchors(transcribed_words, verses, ngram_size=3):
+    # Returns [(verse_index, estimated_start_word)] for verses containing an n-gram that occurs exactly
+    # once in the chapter text and exactly once in the transcript, kept in monotonic order
+    verse_ngrams = {}
+    for verse_index, verse in enumerate(verses):
+        tokens = preprocess_text(verse[1]).split()
+        for offset in range(len(tokens) - ngram_size + 1):
+            key = ' '.join(tokens[offset:offset + ngram_size])
+            verse_ngrams.setdefault(key, []).append((verse_index, offset))
+
+    transcript_tokens = [preprocess_text(word) for word in as_transcript(transcribed_words).words]
+    transcript_ngrams = {}
+    for position in range(len(transcript_tokens) - ngram_size + 1):
+        window = transcript_tokens[position:position + ngram_size]
+        if not all(window):
+            continue
+        transcript_ngrams.setdefault(' '.join(window), []).append(position)
+
+    candidates = []
+    for key, positions in transcript_ngrams.items():
+        occurrences = verse_ngrams.get(key)
+        if len(positions) == 1 and occurrences and len(occurrences) == 1:
+            verse_index, offset = occurrences[0]
+            candidates.append((positions[0], verse_index, offset))
+    candidates.sort()
+
+    # Longest chain increasing in both transcript position and (verse, offset) order
+    chain_tails = []
+    tail_indices = []
+    previous = [None] * len(candidates)
+    for i, (position, verse_index, offset) in enumerate(candidates):
+        slot = bisect.bisect_left(chain_tails, (verse_index, offset))
+        if slot > 0:
+            previous[i] = tail_indices[slot - 1]
+        if slot == len(chain_tails):
+            chain_tails.append((verse_index, offset))
+            tail_indices.append(i)
+        else:
+            chain_tails[slot] = (verse_index, offset)
+            tail_indices[slot] = i
+    chain = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        chain.append(candidates[i])
+        i = previous[i]
+    chain.reverse()
+
+    # One anchor per verse (its first n-gram), with verse starts strictly increasing and leaving at least
+    # one word for every verse in between
+    anchors = []
+    for position, verse_index, offset in chain:
+        estimated_start = max(0, position - offset)
+        if anchors:
+            last_verse, last_start = anchors[-1]
+            if verse_index == last_verse or estimated_start - last_start < verse_index - last_verse:
+                continue
+        elif estimated_start < verse_index:
+            continue
+        anchors.append((verse_index, estimated_start))
+    return anchors
 
+def anchor_segments(anchors, verse_count, word_count):
+    # [(verse_start, verse_end, word_start, word_end)] covering all verses; each anchored verse opens a segment
+    boundaries = [(0, 0)] + [anchor for anchor in anchors if anchor[0] > 0] + [(verse_count, word_count)]
+    segments = []
+    for (verse_start, word_start), (verse_end, word_end) in zip(boundaries, boundaries[1:]):
+        if verse_end > verse_start:
+            segments.append((verse_start, verse_end, word_start, word_end))
+    return segments
 
-def split_audio(audio_file, alignment, verses, transcribed_words, output_path='audio/output'):
-    audio = AudioSegment.from_mp3(audio_file)
-    total_duration = len(audio)
+
+def align_verses_ctc(audio_file, verses, book_name, output_folder, ctc_model, device=None, visualization='sync',
+                     pcm_audio=None):
+    # Forced alignment of the known verse text against Wav2Vec2 CTC emissions, skipping Whisper decoding and
+    # the window search. Returns (alignment, transcript): the transcript holds the verse words with their
+    # aligned times, so split_audio and the alignment artifacts use it like a Whisper transcript.
+    processor, model = model_registry.get_ctc_model(ctc_model, device)
+    if pcm_audio is not None:
+        audio = pcm_audio.asr_view()
+        pcm_audio.release_asr_view()
+    else:
+        audio = decode_asr_audio(audio_file)
+    start_time = time.time()
+    emissions = compute_emissions(audio, processor, model, device=model.device)
+    frame_ms = 1000 * model.config.inputs_to_logits_ratio / SAMPLE_RATE
+    print(f"CTC emissions: {len(emissions)} frames in {time.time() - start_time:.2f} seconds")
+
+    verse_texts = [preprocess_text(verse[1]) for verse in verses]
+    tokenizer = processor.tokenizer
+    transcript, alignment, ratios = force_align_verses(
+        emissions, verse_texts, tokenizer.get_vocab(), tokenizer.pad_token_id, frame_ms,
+        word_delimiter=getattr(tokenizer, 'word_delimiter_token', None) or '|')
+
+    records = [
+        {
+            'verse_ref': verse[0],
+            'verse_text': verse_text,
+            'start_window': start,
+            'end_window': end,
+            'best_start': start,
+            'best_end': end,
+            'best_ratio': ratio
+        }
+        for verse, verse_text, (start, end), ratio in zip(verses, verse_texts, alignment, ratios)
+    ]
+    summary_lines = [f"ctc model={ctc_model} frames={len(emissions)} (ratio = 100 * exp(mean token log-prob))"]
+    collect_alignment(records, transcript, book_name, output_folder, summary_lines, visualization)
+    return alignment, transcript
+
+def iter_verse_times(alignment, transcribed_words, total_duration, last_verse_padding_ms=2000, verse_padding_ms=0,
+                     snapper=None):
+    # (start_ms, end_ms) for each aligned verse: from its first word's start to the next verse's first word.
+    # With a BoundarySnapper every cut moves to the quietest nearby frame before padding is added. Times are
+    # resolved one verse at a time, so a ReaderSnapper decodes only as far as the verse being exported.
+    snap = snapper.snap if snapper is not None else (lambda time_ms: time_ms)
+    transcribed_words = as_transcript(transcribed_words)
+    word_starts = transcribed_words.start_ms
+    word_ends = transcribed_words.end_ms
+    last_word = len(transcribed_words) - 1
 
     for i, (start, end) in enumerate(alignment):
-        start_ms = max(0, transcribed_words[start]['start'])
+        start_ms = max(0, snap(word_starts[start]) - verse_padding_ms)
         
-        # For the last verse, capture up to the end of the audio file, unless it exceeds 2 additional seconds
+        # For the last verse, capture up to the end of the audio file, unless it exceeds last_verse_padding_ms
         if i == len(alignment) - 1:
-            end_ms = min(total_duration, transcribed_words[min(end-1, len(transcribed_words)-1)]['end'] + 2000)  # Add up to 2 seconds
-            end_ms = min(end_ms, total_duration)  # Ensure we don't exceed the total duration
+            end_ms = min(total_duration, snap(word_ends[min(end-1, last_word)] + last_verse_padding_ms))
         else:
-            end_ms = min(total_duration, transcribed_words[min(end, len(transcribed_words)-1)]['start'])
-        
-        if start_ms >= end_ms or start_ms >= total_duration or end_ms <= 0:
-            print(f"Warning: Invalid time range for verse {verses[i][0]}. Skipping.")
-            continue
+            end_ms = min(total_duration, snap(word_starts[min(end, last_word)]) + verse_padding_ms)
+        yield start_ms, end_ms
 
-        verse_audio = audio[start_ms:end_ms]
-        
-        if len(verse_audio) < 100:  # If the audio segment is less than 100ms, it's probably an error
-            print(f"Warning: Very short audio segment for verse {verses[i][0]}. Skipping.")
-            continue
+def split_audio(audio_file, alignment, verses, transcribed_words, output_path='audio/output', verse_times=None,
+                output_format='mp3', last_verse_padding_ms=2000, verse_padding_ms=0, pcm_audio=None,
+                split_backend='pydub', max_copy_error_ms=20, export_workers=1, codec_options=None,
+                snap_tolerance_ms=0, chapter_end_ms=None, snapper=None):
+    # Exports one file per verse and returns the (start_ms, end_ms) used for each verse. verse_times
+    # overrides the times resolved from the transcript (e.g. when re-splitting from stored artifacts).
+    # pcm_audio is the already decoded chapter; without it verses are decoded range by range. split_backend 'ffmpeg'
+    # cuts every verse in one ffmpeg run without decoding here; stream-copied verses get the frame-aligned
+    # times they actually hold. With 'pydub', export_workers threads run the verse encoders in parallel;
+    # failed exports are listed once the chapter is done. output_format is one format or a list of them (e.g.
+    # ['mp3', 'webm']): every format of a verse is encoded from the same source segment in one ffmpeg run, with
+    # the extra ffmpeg output arguments codec_options gives for the format. split_backend 'virtual' writes the
+    # chapter once as an mp3 with an index of each verse's frame-aligned times and byte range (see virtual_split).
+    # snap_tolerance_ms > 0 moves the resolved cuts to quiet frames up to that far away (see boundary_snapping).
+    # Verse times are resolved as the verses are exported, so a PcmReader snaps on the frames it decodes anyway.
+    # In a recording of several chapters, chapter_end_ms is where the chapter ends (no verse runs past it) and
+    # snapper a BoundarySnapper computed once for the whole recording.
+    transcribed_words = as_transcript(transcribed_words)
+    output_formats = [output_format] if isinstance(output_format, str) else list(output_format)
+    if split_backend == 'virtual' and (output_formats != ['mp3'] or (codec_options or {}).get('mp3')):
+        print(f"Warning: split_backend 'virtual' writes one mp3 per chapter; output_format {output_format!r} and "
+              f"mp3 codec_options are ignored.")
+    if split_backend in ('ffmpeg', 'virtual'):
+        audio = None
+        if pcm_audio is not None:
+            total_duration = len(pcm_audio)
+        else:
+            total_duration = int(float(mediainfo(audio_file)['duration']) * 1000)
+    else:
+        audio = pcm_audio if pcm_audio is not None else PcmReader(audio_file)
+        total_duration = len(audio)
+    if chapter_end_ms is not None:
+        total_duration = min(total_duration, chapter_end_ms)
+    if verse_times is None:
+        if snapper is None and snap_tolerance_ms > 0:
+            if isinstance(audio, PcmReader):
+                snapper = ReaderSnapper(audio, tolerance_ms=snap_tolerance_ms, lead_ms=verse_padding_ms)
+            else:
+                snapper = BoundarySnapper(energy_envelope(audio_file, pcm_audio), tolerance_ms=snap_tolerance_ms)
+        resolved_times = iter_verse_times(alignment, transcribed_words, total_duration,
+                                          last_verse_padding_ms, verse_padding_ms, snapper)
+    else:
+        resolved_times = iter(verse_times)
+    verse_times = []
 
-        output_filename = f"verse_{verses[i][0]}.mp3".replace(":", "_")
-        output_file_path = os.path.join(output_path, output_filename)
-        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-        verse_audio.export(output_file_path, format="mp3")
-        
-        verse_text = ' '.join([w['word'] for w in transcribed_words[start:min(end, len(transcribed_words))]])
+    def report_export(i, output_filename):
+        start, end = alignment[i]
+        start_ms, end_ms = verse_times[i]
+        verse_text = transcribed_words.join(start, end)
         print(f"Exported {output_filename}: {verses[i][0]} ({end - start} words)")
         print(f"Transcribed text: {verse_text}")
         print(f"Start time: {start_ms}ms, End time: {end_ms}ms")
         print(f"Duration: {end_ms - start_ms}ms")
         print("-" * 80)
 
+    export_errors = []
+    # Submitted exports, reported in verse order; at most 2 * export_workers verse segments are held at a time
+    in_flight = deque()
 
-def process_single_file(audio_file, verses, language, output_folder):
-    transcribed_words = transcribe_audio_with_timestamps(audio_file, language=language)
-    if transcribed_words:
-        book_name = verses[0][0].split('_')[0]  # Extract book name from the first verse reference
-        alignment = align_verses(transcribed_words, verses, book_name, output_folder)
-        
-        print("\nFinal Alignment:")
+    def finish_oldest_export():
+        i, output_filename, future = in_flight.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            export_errors.append((verses[i][0], e))
+            return
+        report_export(i, output_filename)
+
+    export_workers = max(1, export_workers)
+    with ThreadPoolExecutor(max_workers=export_workers) as executor:
+        ffmpeg_exports = []
         for i, (start, end) in enumerate(alignment):
-            print(f"Verse {verses[i][0]}: {start} to {end}")
+            start_ms, end_ms = next(resolved_times)
+            verse_times.append((start_ms, end_ms))
         
-        split_audio(audio_file, alignment, verses, transcribed_words, output_path=output_folder)
+            if start_ms >= end_ms or start_ms >= total_duration or end_ms <= 0:
+                print(f"Warning: Invalid time range for verse {verses[i][0]}. Skipping.")
+                continue
+
+            output_filenames = [f"verse_{verses[i][0]}.{fmt}".replace(":", "_") for fmt in output_formats]
+            output_file_paths = [os.path.join(output_path, filename) for filename in output_filenames]
+            output_filename = ', '.join(output_filenames)
+
+            if audio is None:
+                if min(end_ms, total_duration) - start_ms < 100:
+                    print(f"Warning: Very short audio segment for verse {verses[i][0]}. Skipping.")
+                    continue
+                ffmpeg_exports.append((i, output_filename, (start_ms, min(end_ms, total_duration), output_file_paths)))
+                continue
+
+            verse_audio = audio.segment(start_ms, end_ms)
+        
+            if len(verse_audio) < 100:  # If the audio segment is less than 100ms, it's probably an error
+                print(f"Warning: Very short audio segment for verse {verses[i][0]}. Skipping.")
+                continue
+
+            in_flight.append((i, output_filename,
+                              executor.submit(export_verse_audio, verse_audio, output_file_paths, codec_options)))
+            if len(in_flight) > 2 * export_workers:
+                finish_oldest_export()
+        while in_flight:
+            finish_oldest_export()
+    if isinstance(audio, PcmReader):
+        audio.close()
+
+    if ffmpeg_exports and split_backend == 'virtual':
+        # One chapter file and its verse index instead of a file per verse
+        chapter_name = f"chapter_{verses[ffmpeg_exports[0][0]][0].split(':')[0]}"
+        try:
+            chapter_file, exported_times = write_chapter(audio_file, [(verses[i][0], start_ms, end_ms)
+                                                                      for i, _, (start_ms, end_ms, _) in ffmpeg_exports],
+                                                         output_path, chapter_name)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            export_errors.extend((verses[i][0], e) for i, _, _ in ffmpeg_exports)
+        else:
+            for (i, _, _), times in zip(ffmpeg_exports, exported_times):
+                verse_times[i] = times
+                report_export(i, os.path.basename(chapter_file))
+    elif ffmpeg_exports:
+        try:
+            exported_times = export_segments(audio_file, [segment for _, _, segment in ffmpeg_exports],
+                                             max_copy_error_ms, codec_options)
+        except (subprocess.CalledProcessError, OSError) as e:
+            export_errors.extend((verses[i][0], e) for i, _, _ in ffmpeg_exports)
+        else:
+            for (i, output_filename, _), times in zip(ffmpeg_exports, exported_times):
+                verse_times[i] = times
+                report_export(i, output_filename)
+
+    if export_errors:
+        print(f"Export failed for {len(export_errors)} of {len(alignment)} verses of {audio_file}:")
+        for verse_ref, error in export_errors:
+            print(f"  {verse_ref}: {error}")
+
+    return verse_times
+
+def export_verse_audio(verse_audio, output_file_paths, codec_options=None):
+    # The segment's PCM is piped to one ffmpeg run with an output per file, the format following its extension.
+    # Encoded as pydub's export does (a lone mp3 comes out byte-identical), without a temporary wav per format.
+    sample_format = {1: 'u8', 2: 's16le', 3: 's24le', 4: 's32le'}[verse_audio.sample_width]
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-f', sample_format, '-ar', str(verse_audio.frame_rate),
+               '-ac', str(verse_audio.channels), '-i', 'pipe:0']
+    for output_file_path in output_file_paths:
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        output_format = os.path.splitext(output_file_path)[1][1:]
+        command += [*(codec_options or {}).get(output_format, []), '-f', output_format, output_file_path]
+    subprocess.run(command, input=verse_audio.raw_data, check=True)
+
+def write_alignment_artifact(audio_file, language, verses, alignment, verse_times, book_name, output_folder,
+                             chapter_end_ms=None):
+    # Everything needed to re-split the chapter without transcription or alignment (see resplit_from_artifacts).
+    # chapter_end_ms: where the chapter ends in a recording of several chapters (see split_audio)
+    numbered_book_name = get_numbered_book_name(book_name)
+    ratios = {}
+    records_path = os.path.join(output_folder, f"{numbered_book_name}_alignment_records.json")
+    if os.path.exists(records_path):
+        with open(records_path, 'r', encoding='utf-8') as f:
+            ratios = {record['verse_ref']: record['best_ratio'] for record in json.load(f)}
+
+    artifact = {
+        'audio_file': os.path.abspath(audio_file),
+        'language': language,
+        'transcript_file': f"{numbered_book_name}_transcript.bin",
+        'chapter_end_ms': chapter_end_ms,
+        'verses': [
+            {
+                'verse_ref': verse[0],
+                'verse_text': verse[1],
+                'start_index': start,
+                'end_index': end,
+                'start_ms': start_ms,
+                'end_ms': end_ms,
+                'ratio': ratios.get(verse[0])
+            }
+            for verse, (start, end), (start_ms, end_ms) in zip(verses, alignment, verse_times)
+        ]
+    }
+    artifact_path = os.path.join(output_folder, f"{numbered_book_name}_alignment.json")
+    with open(artifact_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=1)
+    print(f"Alignment artifact saved to: {artifact_path}")
+
+def resplit_chapter(artifact_path, output_format='mp3', last_verse_padding_ms=2000, verse_padding_ms=0,
+                    split_backend='pydub', max_copy_error_ms=20, export_workers=1, codec_options=None,
+                    snap_tolerance_ms=0, snapper=None):
+    with open(artifact_path, 'r', encoding='utf-8') as f:
+        artifact = json.load(f)
+    chapter_folder = os.path.dirname(artifact_path)
+    verses = [[verse['verse_ref'], verse['verse_text']] for verse in artifact['verses']]
+    alignment = [(verse['start_index'], verse['end_index']) for verse in artifact['verses']]
+
+    transcript_path = os.path.join(chapter_folder, artifact['transcript_file'])
+    if os.path.exists(transcript_path):
+        # Re-resolve times from the word timestamps so changed boundary rules take effect
+        transcribed_words = Transcript.load(transcript_path)
+        verse_times = None
     else:
-        print(f"Transcription failed for {audio_file}. Unable to proceed with alignment and splitting.")
+        print(f"Transcript not found for {artifact_path}. Using stored verse times.")
+        transcribed_words = Transcript()
+        verse_times = [(verse['start_ms'], verse['end_ms']) for verse in artifact['verses']]
+
+    verse_times = split_audio(artifact['audio_file'], alignment, verses, transcribed_words, output_path=chapter_folder,
+                              verse_times=verse_times, output_format=output_format,
+                              last_verse_padding_ms=last_verse_padding_ms, verse_padding_ms=verse_padding_ms,
+                              split_backend=split_backend, max_copy_error_ms=max_copy_error_ms,
+                              export_workers=export_workers, codec_options=codec_options,
+                              snap_tolerance_ms=snap_tolerance_ms, chapter_end_ms=artifact.get('chapter_end_ms'),
+                              snapper=snapper)
+
+    for verse, (start_ms, end_ms) in zip(artifact['verses'], verse_times):
+        verse['start_ms'] = start_ms
+        verse['end_ms'] = end_ms
+    with open(artifact_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=1)
+
+def resplit_from_artifacts(output_folder, **split_options):
+    # Re-exports every chapter under output_folder from its alignment artifact, skipping transcription and alignment.
+    # The chapters cut from one whole-book recording share the book's snapping envelope (built on first use).
+    snappers = {}
+    for root, dirs, files in os.walk(output_folder):
+        for file in sorted(files):
+            if file.endswith('_alignment.json'):
+                artifact_path = os.path.join(root, file)
+                print(f"Re-splitting {artifact_path}")
+                snapper = None
+                if (split_options.get('snap_tolerance_ms', 0) > 0
+                        and split_options.get('split_backend', 'pydub') in ('ffmpeg', 'virtual')):
+                    with open(artifact_path, 'r', encoding='utf-8') as f:
+                        audio_file = json.load(f)['audio_file']
+                    if audio_file not in snappers:
+                        # Keep only the current recording's envelope; a book's chapters are walked together
+                        snappers = {audio_file: BoundarySnapper(energy_envelope(audio_file),
+                                                                tolerance_ms=split_options['snap_tolerance_ms'])}
+                    snapper = snappers[audio_file]
+                resplit_chapter(artifact_path, snapper=snapper, **split_options)
+
+def process_single_file(audio_file, verses, language, output_folder, alignment_method='window', window_scorer='fuzz',
+                        min_length_ratio=None, max_length_ratio=None, anchor_ngram_size=3, alignment_workers=1,
+                        adaptive_windows=False, adaptive_threshold=80, adaptive_extensions=(25, 100),
+                        visualization='sync', output_format='mp3', last_verse_padding_ms=2000, verse_padding_ms=0,
+                        whisper_model='small', whisper_device=None, whisper_precision=None,
+                        transcript_cache_dir=None, transcript_cache_max_mb=1024, transcription_chunk_ms=None,
+                        chunk_overlap_ms=1000, transcription_workers=1, skip_non_speech=False,
+                        transcription_batch_size=1, split_backend='pydub', max_copy_error_ms=20, export_workers=1,
+                        codec_options=None, snap_tolerance_ms=0,
+                        ctc_model='jonatasgrosman/wav2vec2-large-xlsr-53-spanish', transcription_pool=None):
+    book_name = verses[0][0].split('_')[0]  # Extract book name from the first verse reference
+    # Decoded once when a model reads the chapter in this process (CTC, or Whisper without a cached transcript):
+    # the model reads its 16 kHz view and verses are exported from slices of it. Otherwise split_audio decodes
+    # only the verse ranges.
+    pcm_audio = None
+    if alignment_method == 'ctc':
+        pcm_audio = PcmAudio.decode(audio_file)
+    elif transcription_pool is None:
+        cache, cache_key, _ = transcript_cache_entry(audio_file, language, whisper_model, whisper_device,
+                                                     whisper_precision, transcript_cache_dir,
+                                                     transcript_cache_max_mb, transcription_chunk_ms,
+                                                     chunk_overlap_ms, skip_non_speech, transcription_batch_size)
+        if cache is None or not cache.contains(cache_key):
+            pcm_audio = PcmAudio.decode(audio_file)
+    if alignment_method == 'ctc':
+        # Forced alignment of the known text; the returned transcript holds the verse words with their times
+        alignment, transcribed_words = align_verses_ctc(audio_file, verses, book_name, output_folder, ctc_model,
+                                                        whisper_device, visualization, pcm_audio)
+    else:
+        transcribed_words = transcribe_audio_with_timestamps(audio_file, language, whisper_model, whisper_device,
+                                                             whisper_precision, transcript_cache_dir,
+                                                             transcript_cache_max_mb, transcription_chunk_ms,
+                                                             chunk_overlap_ms, transcription_workers,
+                                                             transcription_pool, pcm_audio, skip_non_speech,
+                                                             transcription_batch_size)
+        if not transcribed_words:
+            print(f"Transcription failed for {audio_file}. Unable to proceed with alignment and splitting.")
+            return
+        if alignment_method == 'dp':
+            alignment = align_verses_dp(transcribed_words, verses, book_name, output_folder, visualization=visualization)
+        elif alignment_method == 'anchored':
+            alignment = align_verses_anchored(transcribed_words, verses, book_name, output_folder,
+                                              ngram_size=anchor_ngram_size, workers=alignment_workers,
+                                              scorer=window_scorer, min_length_ratio=min_length_ratio,
+                                              max_length_ratio=max_length_ratio, adaptive=adaptive_windows,
+                                              adaptive_threshold=adaptive_threshold,
+                                              adaptive_extensions=adaptive_extensions, visualization=visualization)
+        else:
+            alignment = align_verses(transcribed_words, verses, book_name, output_folder, scorer=window_scorer,
+                                     min_length_ratio=min_length_ratio, max_length_ratio=max_length_ratio,
+                                     adaptive=adaptive_windows, adaptive_threshold=adaptive_threshold,
+                                     adaptive_extensions=adaptive_extensions, visualization=visualization)
+
+    print("\nFinal Alignment:")
+    for i, (start, end) in enumerate(alignment):
+        print(f"Verse {verses[i][0]}: {start} to {end}")
+    
+    verse_times = split_audio(audio_file, alignment, verses, transcribed_words, output_path=output_folder,
+                              output_format=output_format, last_verse_padding_ms=last_verse_padding_ms,
+                              verse_padding_ms=verse_padding_ms, pcm_audio=pcm_audio, split_backend=split_backend,
+                              max_copy_error_ms=max_copy_error_ms, export_workers=export_workers,
+                              codec_options=codec_options, snap_tolerance_ms=snap_tolerance_ms)
+    write_alignment_artifact(audio_file, language, verses, alignment, verse_times, book_name, output_folder)
 
-def process_book_folder(book_folder, verses, language, output_folder):
+def process_book_folder(book_folder, verses, language, output_folder, **options):
     book_name = os.path.basename(book_folder)
     current_chapter = None
     chapter_verses = []
+    chapters = []
 
     for verse in verses:
         verse_ref = verse[0].split('_')
@@ -270,15 +1048,20 @@ def process_book_folder(book_folder, verses, language, output_folder):
 
         if chapter != current_chapter:
             if chapter_verses:
-                process_chapter(book_folder, current_chapter, chapter_verses, language, output_folder)
+                chapters.append((current_chapter, chapter_verses))
             current_chapter = chapter
             chapter_verses = []
         chapter_verses.append(verse)
 
     if chapter_verses:
-        process_chapter(book_folder, current_chapter, chapter_verses, language, output_folder)
+        chapters.append((current_chapter, chapter_verses))
+
+    prefetch_transcriptions([os.path.join(book_folder, f"{chapter}.mp3") for chapter, _ in chapters], language,
+                            **options)
+    for chapter, chapter_verses in chapters:
+        process_chapter(book_folder, chapter, chapter_verses, language, output_folder, **options)
 
-def process_chapter(book_folder, chapter, verses, language, output_folder):
+def process_chapter(book_folder, chapter, verses, language, output_folder, **options):
     audio_file = os.path.join(book_folder, f"{chapter}.mp3")
     if os.path.exists(audio_file):
         book_name = os.path.basename(book_folder)
@@ -286,11 +1069,11 @@ def process_chapter(book_folder, chapter, verses, language, output_folder):
         numbered_book_name = f"{book_number:02d}_{book_name}"
         chapter_output_folder = os.path.join(output_folder, numbered_book_name, str(chapter))
         os.makedirs(chapter_output_folder, exist_ok=True)
-        process_single_file(audio_file, verses, language, chapter_output_folder)
+        process_single_file(audio_file, verses, language, chapter_output_folder, **options)
     else:
         print(f"Audio file not found for chapter {chapter} in {book_folder}")
 
-def process_multiple_books(audio_folder, verses, language, output_folder):
+def process_multiple_books(audio_folder, verses, language, output_folder, **options):
     current_book = None
     book_verses = []
 
@@ -300,7 +1083,7 @@ def process_multiple_books(audio_folder, verses, language, output_folder):
             if book_verses:
                 book_folder = os.path.join(audio_folder, current_book)
                 if os.path.exists(book_folder):
-                    process_book_folder(book_folder, book_verses, language, output_folder)
+                    process_book_folder(book_folder, book_verses, language, output_folder, **options)
                 else:
                     print(f"Book folder not found: {book_folder}")
             current_book = book
@@ -310,10 +1093,242 @@ def process_multiple_books(audio_folder, verses, language, output_folder):
     if book_verses:
         book_folder = os.path.join(audio_folder, current_book)
         if os.path.exists(book_folder):
-            process_book_folder(book_folder, book_verses, language, output_folder)
+            process_book_folder(book_folder, book_verses, language, output_folder, **options)
         else:
             print(f"Book folder not found: {book_folder}")
 
+def align_verses_streaming(word_stream, verses, extension_percentage=300, scorer='fuzz', adaptive_threshold=80,
+                           adaptive_extensions=(25, 100), lookback_words=5, intro_words=200):
+    # Aligns verses against a stream of (word, start_ms, end_ms) tuples and yields one record per verse as
+    # soon as its window has been read. Windows are sized from the verse's own word count around the previous
+    # verse's end (widening like adaptive mode), so they do not drift over multi-hour recordings, and only
+    # the words still inside the sliding window are kept in memory.
+    stream = iter(word_stream)
+    buffer = Transcript()
+    buffer_offset = 0  # absolute index of buffer[0]
+    stream_done = False
+    cursor = 0
+
+    def fill(until):
+        nonlocal stream_done
+        while not stream_done and buffer_offset + len(buffer) < until:
+            try:
+                word, start_ms, end_ms = next(stream)
+            except StopIteration:
+                stream_done = True
+                break
+            buffer.append(word, start_ms, end_ms)
+
+    for verse_index, verse in enumerate(verses):
+        verse_text = preprocess_text(verse[1])
+        expected_words = max(1, len(verse_text.split()))
+        if verse_index == 0:
+            extensions = [extension_percentage * 2]
+        else:
+            extensions = list(adaptive_extensions) + [extension_percentage]
+
+        best_ratio = 0
+        best_start = None
+        best_end = None
+        counters = new_search_counters()
+        escalations = -1
+        for extension in extensions:
+            escalations += 1
+            extension_words = max(1, int(expected_words * (extension / 100)))
+            start_window = max(buffer_offset, cursor - min(lookback_words, extension_words))
+            end_window = cursor + expected_words + extension_words + 1
+            if verse_index == 0:
+                end_window += intro_words
+            # One extra word so the word after the window (where the verse ends) is available
+            fill(end_window + 1)
+            end_window = min(end_window, buffer_offset + len(buffer))
+
+            window_scorer = BatchWindowScorer(buffer) if scorer == 'batch' else None
+            ratio, start, end, window_counters = find_best_window(
+                buffer, buffer.char_offsets, verse_text, start_window - buffer_offset, end_window - buffer_offset,
+                window_scorer)
+            for key in counters:
+                counters[key] += window_counters[key]
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_start = start + buffer_offset
+                best_end = end + buffer_offset
+            if best_ratio >= adaptive_threshold or (stream_done and end_window == buffer_offset + len(buffer)):
+                break
+
+        buffered_words = buffer_offset + len(buffer)
+        if best_ratio == 0:
+            best_start = min(cursor, buffered_words - 1)
+            best_end = min(cursor + expected_words, buffered_words)
+        if best_start is None or best_start < 0:
+            print(f"Warning: No transcribed words left for verse {verse[0]}.")
+            continue
+
+        start_ms = buffer.start_ms[best_start - buffer_offset]
+        if best_end < buffered_words:
+            end_ms = buffer.start_ms[best_end - buffer_offset]
+            next_word_start_ms = end_ms
+        else:
+            end_ms = buffer.end_ms[best_end - 1 - buffer_offset]
+            next_word_start_ms = None
+
+        yield {
+            'verse_ref': verse[0],
+            'verse_text': verse_text,
+            'start_window': start_window,
+            'end_window': end_window,
+            'best_start': best_start,
+            'best_end': best_end,
+            'best_ratio': best_ratio,
+            'counters': counters,
+            'escalations': escalations,
+            'start_ms': start_ms,
+            'end_ms': end_ms,
+            'next_word_start_ms': next_word_start_ms,
+            'last_word_end_ms': buffer.end_ms[best_end - 1 - buffer_offset]
+        }
+
+        cursor = best_end
+        drop = max(0, min(cursor - lookback_words, buffered_words) - buffer_offset)
+        if drop:
+            buffer = buffer[drop:]
+            buffer_offset += drop
+
+def process_long_form_file(audio_file, verses, language, output_folder, alignment_method='window',
+                           window_scorer='fuzz', adaptive_threshold=80, adaptive_extensions=(25, 100),
+                           visualization='sync', output_format='mp3', last_verse_padding_ms=2000, verse_padding_ms=0,
+                           snap_tolerance_ms=0, split_backend='pydub', max_copy_error_ms=20, export_workers=1,
+                           codec_options=None, whisper_model='small', whisper_device=None, whisper_precision=None,
+                           transcript_cache_dir=None, transcript_cache_max_mb=1024, transcription_chunk_ms=None,
+                           chunk_overlap_ms=1000, transcription_workers=1, skip_non_speech=False,
+                           transcription_batch_size=1, transcription_pool=None, **options):
+    # Whole-book (or multi-chapter) recordings: the recording is transcribed whole (or read from the transcript
+    # cache), then the streaming window search walks its words once, and each chapter is split (with split_audio,
+    # so every split option applies) and gets its alignment artifact as soon as its last verse is aligned. A chapter's last verse ends at most at the next chapter's first word.
+    # Alignment always uses the streaming window search; options of the other alignment methods do not apply.
+    if split_backend == 'virtual':
+        raise ValueError("split_backend 'virtual' writes one mp3 per source file and is not available for long-form "
+                         "recordings; use 'pydub' or 'ffmpeg'")
+    if alignment_method != 'window':
+        print(f"Warning: long-form recordings are aligned with the streaming window search; "
+              f"alignment_method '{alignment_method}' is ignored.")
+    for name in ('min_length_ratio', 'max_length_ratio'):
+        if options.get(name) is not None:
+            print(f"Warning: {name} is not applied to long-form recordings.")
+    transcribed_words = transcribe_audio_with_timestamps(audio_file, language, whisper_model, whisper_device,
+                                                         whisper_precision, transcript_cache_dir,
+                                                         transcript_cache_max_mb, transcription_chunk_ms,
+                                                         chunk_overlap_ms, transcription_workers,
+                                                         transcription_pool, skip_non_speech=skip_non_speech,
+                                                         transcription_batch_size=transcription_batch_size)
+    if not transcribed_words:
+        print(f"Transcription failed for {audio_file}. Unable to proceed with alignment and splitting.")
+        return
+
+    snapper = None
+    if snap_tolerance_ms > 0 and split_backend == 'ffmpeg':
+        # One envelope for the whole recording; the pydub backend snaps on the ranges it decodes for the verses
+        snapper = BoundarySnapper(energy_envelope(audio_file), tolerance_ms=snap_tolerance_ms)
+    verse_texts = dict((verse[0], verse[1]) for verse in verses)
+
+    # Words of the chapter being aligned, kept for its fuzzy ratio log, visualization and split
+    chapter = {'key': None, 'records': [], 'words': Transcript(), 'offset': 0}
+
+    def record_words(word_stream):
+        for word, start_ms, end_ms in word_stream:
+            chapter['words'].append(word, start_ms, end_ms)
+            yield word, start_ms, end_ms
+
+    def flush_chapter(next_word=None):
+        # next_word: the next chapter's first aligned word, where this chapter's last verse has to end
+        if not chapter['records']:
+            return
+        book_name, chapter_number = chapter['key']
+        chapter_output_folder = os.path.join(output_folder, get_numbered_book_name(book_name), chapter_number)
+        # A window may reach lookback_words back into the previous chapter; its words stay with that chapter
+        first_word = max(chapter['records'][0]['best_start'], chapter['offset'])
+        last_word = min(max(chapter['records'][-1]['best_end'], first_word + 1),
+                        chapter['offset'] + len(chapter['words']))
+        chapter_words = chapter['words'][first_word - chapter['offset']:last_word - chapter['offset']]
+        if not len(chapter_words):
+            print(f"Warning: No transcribed words left for chapter {book_name} {chapter_number}. Skipping.")
+            chapter['records'] = []
+            return
+        chapter_end_ms = None
+        if next_word is not None:
+            chapter_end_ms = chapter['words'].start_ms[max(next_word, last_word) - chapter['offset']]
+        for record in chapter['records']:
+            for key in ('start_window', 'end_window', 'best_start', 'best_end'):
+                record[key] = min(max(record[key] - first_word, 0), len(chapter_words))
+            record['best_start'] = min(record['best_start'], len(chapter_words) - 1)
+        alignment = collect_alignment(chapter['records'], chapter_words, book_name, chapter_output_folder,
+                                      visualization=visualization)
+        chapter_verses = [[record['verse_ref'], verse_texts[record['verse_ref']]] for record in chapter['records']]
+        verse_times = split_audio(audio_file, alignment, chapter_verses, chapter_words,
+                                  output_path=chapter_output_folder, output_format=output_format,
+                                  last_verse_padding_ms=last_verse_padding_ms, verse_padding_ms=verse_padding_ms,
+                                  split_backend=split_backend, max_copy_error_ms=max_copy_error_ms,
+                                  export_workers=export_workers, codec_options=codec_options,
+                                  snap_tolerance_ms=snap_tolerance_ms, chapter_end_ms=chapter_end_ms,
+                                  snapper=snapper)
+        write_alignment_artifact(audio_file, language, chapter_verses, alignment, verse_times, book_name,
+                                 chapter_output_folder, chapter_end_ms)
+        chapter['words'] = chapter['words'][last_word - chapter['offset']:]
+        chapter['offset'] = last_word
+        chapter['records'] = []
+
+    word_stream = (
+        (transcribed_words.word(i), transcribed_words.start_ms[i], transcribed_words.end_ms[i])
+        for i in range(len(transcribed_words))
+    )
+    records = align_verses_streaming(record_words(word_stream), verses, scorer=window_scorer,
+                                     adaptive_threshold=adaptive_threshold, adaptive_extensions=adaptive_extensions)
+    for record in records:
+        book_name, chapter_verse = record['verse_ref'].split('_')
+        chapter_key = (book_name, chapter_verse.split(':')[0])
+        if chapter_key != chapter['key']:
+            flush_chapter(record['best_start'])
+            chapter['key'] = chapter_key
+        chapter['records'].append(record)
+
+        print(f"Aligned {record['verse_ref']}: ratio {record['best_ratio']}, "
+              f"{record['start_ms']}ms to {record['end_ms']}ms")
+
+    flush_chapter()
+
+def process_long_form_folder(audio_folder, verses, language, output_folder, **options):
+    # Folder of one recording per book, named by book code (e.g. GEN.mp3)
+    book_verses = {}
+    for verse in verses:
+        book_verses.setdefault(verse[0].split('_')[0], []).append(verse)
+    prefetch_transcriptions([os.path.join(audio_folder, f"{book}.mp3") for book in book_verses], language, **options)
+    for book, verses_in_book in book_verses.items():
+        audio_file = os.path.join(audio_folder, f"{book}.mp3")
+        if os.path.exists(audio_file):
+            process_long_form_file(audio_file, verses_in_book, language, output_folder, **options)
+        else:
+            print(f"Audio file not found for book {book} in {audio_folder}")
+
+def process_audio_path(audio_file, verses, language, output_folder, long_form=False, **options):
+    if long_form:
+        # Whole-book recordings, split chapter by chapter as the alignment reaches them
+        if os.path.isfile(audio_file):
+            process_long_form_file(audio_file, verses, language, output_folder, **options)
+        else:
+            process_long_form_folder(audio_file, verses, language, output_folder, **options)
+    elif os.path.isfile(audio_file):
+        # Process single file
+        process_single_file(audio_file, verses, language, output_folder, **options)
+    elif os.path.isdir(audio_file):
+        if any(os.path.isdir(os.path.join(audio_file, d)) for d in os.listdir(audio_file)):
+            # Process multiple books
+            process_multiple_books(audio_file, verses, language, output_folder, **options)
+        else:
+            # Process single book folder
+            process_book_folder(audio_file, verses, language, output_folder, **options)
+    else:
+        print(f"Invalid audio_file path: {audio_file}")
+
 def main():
     #*******************PARAMETERS*******************#
     language = 'es'  # e.g., 'es' (text and audio language)
@@ -324,35 +1339,115 @@ def main():
     ebible = 'C:/Users/caleb/Downloads/SPAWTC_palabra_de_dios_para_todos_text/content/chapters'  # e.g., 'spa-spaRV1909' (uses eng versification by default)
     bible_type = 'xhtml' # 'ebible'
     audio_output_folder = 'audio/output/PDT' 
+    alignment_method = 'window'  # 'window' (per-verse window search), 'dp' (single pass over the chapter; much faster, less accurate boundaries), 'anchored' (window search between exact n-gram anchors) or 'ctc' (forced alignment of the verse text, no Whisper)
+    window_scorer = 'fuzz'  # 'fuzz' (fuzz.ratio per window) or 'batch' (same scores, one pass per window start)
+    min_length_ratio = None  # e.g. 0.5: skip windows shorter than half the verse text (None = no limit)
+    max_length_ratio = None  # e.g. 2.0: skip windows longer than twice the verse text (None = no limit)
+    anchor_ngram_size = 3  # words per n-gram used as an anchor ('anchored' method)
+    alignment_workers = 1  # processes used to align anchored segments in parallel
+    adaptive_windows = False  # search from the previous verse's end first, widening only on low ratios
+    adaptive_threshold = 80  # ratio below which an adaptive window is widened
+    adaptive_extensions = (25, 100)  # adaptive window extensions (%) tried before the full proportional window
+    visualization = 'sync'  # 'sync', 'background' (writer thread) or 'off' (render later with render_visualizations)
+    long_form = False  # True when audio_file is one recording per book (a file, or a folder of <BOOK>.mp3 files)
+    mode = 'full'  # 'full' (transcribe, align, split) or 'resplit' (re-export audio_output_folder from stored alignment artifacts)
+    output_format = 'mp3'  # verse file format, or a list written in one pass, e.g. ['mp3', 'webm']
+    codec_options = {'webm': ['-c:a', 'libopus']}  # extra ffmpeg output arguments per format, e.g. {'webm': ['-c:a', 'libopus', '-b:a', '32k']}
+    last_verse_padding_ms = 2000  # audio kept after the last word of the last verse
+    verse_padding_ms = 0  # audio added before each verse's first word and after its end
+    snap_tolerance_ms = 0  # e.g. 250: move each verse cut to the quietest 10 ms frame within this distance, when it is near the noise floor (0 = cut at word times)
+    split_backend = 'pydub'  # 'pydub' (re-encode every verse), 'ffmpeg' (one ffmpeg run per chapter, mp3 verses stream-copied) or 'virtual' (one mp3 per chapter plus a verse byte-range index)
+    max_copy_error_ms = 20  # 'ffmpeg': verses whose mp3 frame-aligned cut is further off than this are re-encoded
+    export_workers = 4  # 'pydub': threads encoding verse files in parallel
+    whisper_model = 'small'  # Whisper model name, loaded once and reused for every chapter
+    whisper_device = None  # e.g. 'cuda:0' or 'cpu' (None = CUDA if available); also used by the CTC model
+    whisper_precision = None  # 'fp16', 'fp32' or 'int8' (CPU only; None = fp16 on CUDA, fp32 on CPU)
+    warm_up_model = True  # load the model and run a short decode before the first chapter
+    transcript_cache_dir = 'transcript_cache'  # reuse transcripts of unchanged audio across runs (None = always transcribe)
+    transcript_cache_max_mb = 1024  # least recently used transcripts are evicted past this size
+    transcription_chunk_ms = None  # e.g. 60000: transcribe in chunks of about this length cut at silences (None = whole file)
+    chunk_overlap_ms = 1000  # audio shared by neighbouring chunks; duplicated words are dropped
+    transcription_workers = 1  # processes transcribing chunks in parallel (each loads its own model)
+    skip_non_speech = False  # cut intros, music beds and long silences (energy/spectral flatness pass) before Whisper
+    transcription_batch_size = 1  # e.g. 8: transcribe short chapters together, this many 30 s windows per forward pass
+    ctc_model = 'jonatasgrosman/wav2vec2-large-xlsr-53-spanish'  # character-level Wav2Vec2 CTC model for the audio language ('ctc' method)
+    chapter_workers = 1  # processes transcribing chapters in parallel, each with its own resident model
+    threads_per_worker = None  # torch threads per chapter worker (None = CPU cores split evenly between workers)
     #************************************************#
 
 
 
     start_time = time.time()
     try:
-        scripture_ref = ScriptureReference(start_verse, end_verse, bible_filename=ebible, source_type=bible_type)
-        verses = scripture_ref.verses
+        options = {
+            'alignment_method': alignment_method,
+            'window_scorer': window_scorer,
+            'min_length_ratio': min_length_ratio,
+            'max_length_ratio': max_length_ratio,
+            'anchor_ngram_size': anchor_ngram_size,
+            'alignment_workers': alignment_workers,
+            'adaptive_windows': adaptive_windows,
+            'adaptive_threshold': adaptive_threshold,
+            'adaptive_extensions': adaptive_extensions,
+            'visualization': visualization,
+            'output_format': output_format,
+            'last_verse_padding_ms': last_verse_padding_ms,
+            'verse_padding_ms': verse_padding_ms,
+            'snap_tolerance_ms': snap_tolerance_ms,
+            'split_backend': split_backend,
+            'max_copy_error_ms': max_copy_error_ms,
+            'export_workers': export_workers,
+            'codec_options': codec_options,
+            'whisper_model': whisper_model,
+            'whisper_device': whisper_device,
+            'whisper_precision': whisper_precision,
+            'transcript_cache_dir': transcript_cache_dir,
+            'transcript_cache_max_mb': transcript_cache_max_mb,
+            'transcription_chunk_ms': transcription_chunk_ms,
+            'chunk_overlap_ms': chunk_overlap_ms,
+            'transcription_workers': transcription_workers,
+            'skip_non_speech': skip_non_speech,
+            'transcription_batch_size': transcription_batch_size,
+            'ctc_model': ctc_model,
+        }
 
-        if os.path.isfile(audio_file):
-            # Process single file
-            process_single_file(audio_file, verses, language, audio_output_folder)
-        elif os.path.isdir(audio_file):
-            if any(os.path.isdir(os.path.join(audio_file, d)) for d in os.listdir(audio_file)):
-                # Process multiple books
-                process_multiple_books(audio_file, verses, language, audio_output_folder)
-            else:
-                # Process single book folder
-                process_book_folder(audio_file, verses, language, audio_output_folder)
+        if mode == 'resplit':
+            resplit_from_artifacts(audio_output_folder, output_format=output_format,
+                                   last_verse_padding_ms=last_verse_padding_ms, verse_padding_ms=verse_padding_ms,
+                                   split_backend=split_backend, max_copy_error_ms=max_copy_error_ms,
+                                   export_workers=export_workers, codec_options=codec_options,
+                                   snap_tolerance_ms=snap_tolerance_ms)
         else:
-            print(f"Invalid audio_file path: {audio_file}")
+            scripture_ref = ScriptureReference(start_verse, end_verse, bible_filename=ebible, source_type=bible_type)
+            verses = scripture_ref.verses
+            if chapter_workers > 1 and alignment_method != 'ctc':
+                # Workers load (and warm up) their own models; this process only aligns and splits
+                options['transcription_batch_size'] = 1
+                options['transcription_pool'] = TranscriptionPool(chapter_workers, threads_per_worker, whisper_model,
+                                                                  whisper_device, whisper_precision, warm_up_model)
+            elif transcription_batch_size > 1 and alignment_method != 'ctc':
+                # Queued chapters are transcribed together as they are reached
+                options['transcription_pool'] = BatchedTranscriber(transcription_batch_size, whisper_model,
+                                                                   whisper_device, whisper_precision)
+            elif warm_up_model and alignment_method != 'ctc':
+                # With a transcript cache the model may never be needed, so it is warmed up on first load
+                model_registry.warm_up(whisper_model, whisper_device, whisper_precision,
+                                       defer=bool(transcript_cache_dir))
+            process_audio_path(audio_file, verses, language, audio_output_folder, long_form, **options)
     except Exception as e:
         print(f"An error occurred during processing: {str(e)}")
         import traceback
         traceback.print_exc()
+    if options.get('transcription_pool') is not None:
+        options['transcription_pool'].shutdown()
+    shutdown_executors()
+    wait_for_visualizations()
+    model_registry.release()
 
     end_time = time.time()
     total_time = end_time - start_time
     print(f"\nTotal execution time: {total_time:.2f} seconds")
+    print(model_registry.format_timings())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+import torch
+import whisper
+
+# Whisper models stay resident per (name, device, precision) for the life of the process, so a book or a whole
+# Bible loads each model once instead of once per chapter file. Load and transcription times are tracked
+# separately so the startup cost shows up on its own in the run summary.
+#
+# Precision 'int8' runs on the CPU with the Linear layers (attention projections and MLPs, most of the compute)
+# dynamically quantized to int8; the convolutions, embeddings and layer norms stay fp32, so the output (including
+# word timestamps) has the same format as the fp32 model.
+
+_models = {}
+_pending_warm_ups = set()
+_lock = threading.Lock()
+timings = {'loads': 0, 'load_seconds': 0.0, 'transcriptions': 0, 'transcribe_seconds': 0.0}
+
+
+def resolve_model_key(name='small', device=None, precision=None):
+    # device None picks CUDA when available (whisper.load_model's default, or the CPU for int8); precision None
+    # keeps whisper's default of fp16 on CUDA and fp32 on CPU
+    if device is None:
+        device = 'cpu' if precision == 'int8' or not torch.cuda.is_available() else 'cuda'
+    if precision is None:
+        precision = 'fp16' if str(device).startswith('cuda') else 'fp32'
+    if precision not in ('fp16', 'fp32', 'int8'):
+        raise ValueError(f"Unsupported Whisper precision: {precision}")
+    if precision == 'int8' and str(device) != 'cpu':
+        raise ValueError(f"int8 Whisper models run on the CPU only, not {device}")
+    return name, str(device), precision
+
+
+def get_model(name='small', device=None, precision=None):
+    key = resolve_model_key(name, device, precision)
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"Loading Whisper model {key[0]} on {key[1]} ({key[2]})...")
+            start_time = time.time()
+            model = whisper.load_model(key[0], device=key[1])
+            if key[2] == 'int8':
+                model = quantize_int8(model)
+            elapsed = time.time() - start_time
+            timings['loads'] += 1
+            timings['load_seconds'] += elapsed
+            print(f"Model loaded in {elapsed:.2f} seconds")
+            _models[key] = model
+            if key in _pending_warm_ups:
+                _pending_warm_ups.discard(key)
+                _warm_up_model(model, key)
+    return model
+
+
+def quantize_int8(model):
+    # quantize_dynamic only replaces modules whose type is exactly nn.Linear, so whisper's Linear subclass is
+    # swapped for plain nn.Linear layers holding the same weights first
+    for module in list(model.modules()):
+        for child_name, child in module.named_children():
+            if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+                linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                linear.load_state_dict(child.state_dict())
+                setattr(module, child_name, linear)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def get_ctc_model(name, device=None):
+    # Wav2Vec2 CTC model and processor for forced alignment, resident like the Whisper models
+    key = (name, str(device or ('cuda' if torch.cuda.is_available() else 'cpu')), 'ctc')
+    with _lock:
+        entry = _models.get(key)
+        if entry is None:
+            from transformers import AutoProcessor, Wav2Vec2ForCTC
+
+            print(f"Loading CTC model {name} on {key[1]}...")
+            start_time = time.time()
+            processor = AutoProcessor.from_pretrained(name)
+            model = Wav2Vec2ForCTC.from_pretrained(name).to(key[1]).eval()
+            elapsed = time.time() - start_time
+            timings['loads'] += 1
+            timings['load_seconds'] += elapsed
+            print(f"Model loaded in {elapsed:.2f} seconds")
+            entry = _models[key] = (processor, model)
+    return entry
+
+
+def model_version(name='small'):
+    # Checkpoint hash from whisper's download URL (names outside whisper's list are local checkpoint paths),
+    # plus the whisper package version since decoding changes between releases
+    url = whisper._MODELS.get(name)
+    checkpoint = url.split('/')[-2] if url else os.path.abspath(name)
+    return f"{whisper.__version__}:{checkpoint}"
+
+
+def transcribe(audio, language, name='small', device=None, precision=None, **transcribe_options):
+    key = resolve_model_key(name, device, precision)
+    model = get_model(*key)
+    start_time = time.time()
+    result = model.transcribe(audio, language=language, fp16=key[2] == 'fp16', **transcribe_options)
+    elapsed = time.time() - start_time
+    timings['transcriptions'] += 1
+    timings['transcribe_seconds'] += elapsed
+    print(f"Transcribed in {elapsed:.2f} seconds")
+    return result
+
+
+def warm_up(name='small', device=None, precision=None, defer=False):
+    # Loads the model and decodes one second of silence so the first chapter does not pay for kernel setup.
+    # With defer the warm-up runs when the model is first loaded, so runs served from the transcript cache
+    # never load it.
+    key = resolve_model_key(name, device, precision)
+    if defer and key not in _models:
+        _pending_warm_ups.add(key)
+        return
+    _warm_up_model(get_model(*key), key)
+
+
+def _warm_up_model(model, key):
+    start_time = time.time()
+    model.transcribe(torch.zeros(whisper.audio.SAMPLE_RATE), fp16=key[2] == 'fp16', without_timestamps=True)
+    print(f"Model warm-up took {time.time() - start_time:.2f} seconds")
+
+
+def release(name=None, device=None, precision=None):
+    # Drops one resident model, or all of them when name is None
+    with _lock:
+        if name is None:
+            _models.clear()
+            _pending_warm_ups.clear()
+        else:
+            _models.pop(resolve_model_key(name, device, precision), None)
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def loaded_models():
+    with _lock:
+        return list(_models)
+
+
+def format_timings():
+    return (f"Whisper model loads: {timings['loads']} ({timings['load_seconds']:.2f}s), "
+            f"transcriptions: {timings['transcriptions']} ({timings['transcribe_seconds']:.2f}s)")
@@ -0,0 +1,168 @@
+import subprocess
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import mediainfo
+
+# A chapter decoded once into 16-bit PCM at its own sample rate and channel count. The 16 kHz mono float32 view
+# Whisper (and the CTC model) read is resampled from this buffer by ffmpeg's resampler over raw PCM, so the mp3 is
+# not decoded a second time, and verses are exported from slices of the buffer instead of a second full
+# AudioSegment. PcmReader serves the same verse slices without decoding the whole chapter, for chapters no model
+# reads in this process.
+
+ASR_SAMPLE_RATE = 16000
+# Audio decoded and dropped ahead of a seek target: the first frames after an mp3 seek decode differently (bit
+# reservoir, overlapping transform), later frames match a decode from the start
+SEEK_PREROLL_MS = 500
+
+
+def decode_command(audio_file, sample_rate, channels):
+    return ['ffmpeg', '-nostdin', '-v', 'error', '-i', audio_file, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-ar', str(sample_rate), '-ac', str(channels), '-']
+
+
+def asr_command(sample_rate, channels):
+    # Raw 16-bit PCM on stdin to the 16 kHz mono 16-bit PCM the ASR view is scaled from
+    return ['ffmpeg', '-nostdin', '-v', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels),
+            '-i', '-', '-f', 's16le', '-acodec', 'pcm_s16le', '-ar', str(ASR_SAMPLE_RATE), '-ac', '1', '-']
+
+
+def decode_asr_audio(audio_file):
+    # The samples PcmAudio.decode(audio_file).asr_view() holds, with the decoder piped straight into the
+    # resampler so the chapter is never held at its own sample rate. Every transcription path (in process, pool
+    # workers, batched, CTC) reads this view, so a chapter gets the same model input and transcript whichever
+    # path runs it.
+    info = mediainfo(audio_file)
+    decoder = subprocess.Popen(decode_command(audio_file, int(info['sample_rate']), int(info['channels'])),
+                               stdout=subprocess.PIPE)
+    result = subprocess.run(asr_command(int(info['sample_rate']), int(info['channels'])), stdin=decoder.stdout,
+                            capture_output=True)
+    decoder.stdout.close()
+    if decoder.wait() != 0 or result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {audio_file}")
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+class PcmAudio:
+    def __init__(self, samples, sample_rate, channels):
+        # samples: int16 array of shape (frames, channels)
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._asr_view = None
+
+    @classmethod
+    def decode(cls, audio_file):
+        info = mediainfo(audio_file)
+        sample_rate = int(info['sample_rate'])
+        channels = int(info['channels'])
+        result = subprocess.run(decode_command(audio_file, sample_rate, channels), capture_output=True, check=True)
+        samples = np.frombuffer(result.stdout, np.int16)
+        return cls(samples[:len(samples) - len(samples) % channels].reshape(-1, channels), sample_rate, channels)
+
+    def __len__(self):
+        # Duration in ms, like len(AudioSegment)
+        return int(round(1000 * len(self.samples) / self.sample_rate))
+
+    def asr_view(self):
+        # Mono float32 at 16 kHz, scaled like whisper.load_audio; computed once and kept until release_asr_view
+        if self._asr_view is None:
+            result = subprocess.run(asr_command(self.sample_rate, self.channels), input=self.samples.tobytes(),
+                                    capture_output=True, check=True)
+            self._asr_view = np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+        return self._asr_view
+
+    def release_asr_view(self):
+        self._asr_view = None
+
+    def segment(self, start_ms, end_ms):
+        # AudioSegment of [start_ms, end_ms), built from a slice of the buffer; the same frames as
+        # AudioSegment[start_ms:end_ms] on the decoded file
+        start = int(min(start_ms, len(self)) * self.sample_rate / 1000.0)
+        end = int(min(end_ms, len(self)) * self.sample_rate / 1000.0)
+        return AudioSegment(data=self.samples[start:end].tobytes(), sample_width=2, frame_rate=self.sample_rate,
+                            channels=self.channels)
+
+
+class PcmReader:
+    # A chapter decoded range by range for exporting verses in order. One ffmpeg decoder streams the file
+    # forward: frames before a requested range are decoded and dropped, and only the latest range is kept (a
+    # following verse may overlap it), so memory is bounded by the longest verse and each frame is decoded once.
+    # A range that starts before the kept frames, or more than reseek_ms past the decoder, restarts the decoder
+    # with a seek SEEK_PREROLL_MS ahead of it.
+    def __init__(self, audio_file, reseek_ms=30000):
+        info = mediainfo(audio_file)
+        self.audio_file = audio_file
+        self.sample_rate = int(info['sample_rate'])
+        self.channels = int(info['channels'])
+        self.duration_ms = int(float(info['duration']) * 1000)
+        self.reseek_ms = reseek_ms
+        self._process = None
+        # Next frame the decoder yields; the kept frames end there
+        self._position = 0
+        self._frames = np.empty((0, self.channels), np.int16)
+        # Called with (index of the first frame, frames) for every block decoded, dropped or kept
+        self.on_decode = None
+
+    def __len__(self):
+        return self.duration_ms
+
+    def _open(self, start):
+        self.close()
+        seek = max(0, start - SEEK_PREROLL_MS * self.sample_rate // 1000)
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-nostdin', '-v', 'error'] + (['-ss', f"{seek / self.sample_rate:.6f}"] if seek else []) +
+            ['-i', self.audio_file, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le', '-ar', str(self.sample_rate),
+             '-ac', str(self.channels), '-'],
+            stdout=subprocess.PIPE
+        )
+        self._position = seek
+        self._frames = self._frames[:0]
+
+    def _read(self, count):
+        # Up to count frames from the decoder (fewer at the end of the file)
+        data = self._process.stdout.read(count * 2 * self.channels)
+        frames = np.frombuffer(data[:len(data) - len(data) % (2 * self.channels)], np.int16).reshape(-1, self.channels)
+        if self.on_decode is not None and len(frames):
+            self.on_decode(self._position, frames)
+        self._position += len(frames)
+        return frames
+
+    def _frame_index(self, time_ms):
+        return int(min(max(0, time_ms), len(self)) * self.sample_rate / 1000.0)
+
+    def read_ahead(self, start_ms, end_ms):
+        # Decodes through end_ms without dropping the kept frames, so a following segment that starts among them is
+        # served without decoding them again. Decoding starts at start_ms when no kept frame is at or before it.
+        start = self._frame_index(start_ms)
+        end = self._frame_index(end_ms)
+        if (self._process is None or start < self._position - len(self._frames)
+                or start - self._position > self.reseek_ms * self.sample_rate // 1000):
+            self._open(start)
+            self._read(start - self._position)
+        if end > self._position:
+            self._frames = np.concatenate((self._frames, self._read(end - self._position)))
+
+    def segment(self, start_ms, end_ms):
+        # Same frames as PcmAudio.segment
+        start = self._frame_index(start_ms)
+        end = self._frame_index(end_ms)
+        if (self._process is None or start < self._position - len(self._frames)
+                or start - self._position > self.reseek_ms * self.sample_rate // 1000):
+            self._open(start)
+        if start >= self._position:
+            self._read(start - self._position)
+            self._frames = self._frames[:0]
+        else:
+            self._frames = self._frames[start - (self._position - len(self._frames)):]
+        if end > self._position:
+            self._frames = np.concatenate((self._frames, self._read(end - self._position)))
+        return AudioSegment(data=self._frames[:max(0, end - start)].tobytes(), sample_width=2,
+                            frame_rate=self.sample_rate, channels=self.channels)
+
+    def close(self):
+        if self._process is not None:
+            # Killed before its pipe is closed, so ffmpeg never reports a broken pipe
+            self._process.kill()
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
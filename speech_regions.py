@@ -0,0 +1,84 @@
+import numpy as np
+
+# Non-speech pre-pass over the 16 kHz audio, run before Whisper. A frame counts as speech when its energy is above
+# the chapter's noise floor, its spectrum is not flat (hiss and room noise are) and its energy moves over the
+# surrounding second (speech rises and falls with its syllables; music beds and steady noise do not). Only
+# non-speech runs of at least min_non_speech_ms are cut, so pauses between words and verses stay in the audio
+# Whisper sees, and word times are mapped back to the original timeline afterwards.
+
+
+def frame_features(audio, sample_rate=16000, frame_ms=30, block_frames=4096):
+    # (energy dB, spectral flatness) per frame_ms frame; the spectrum is computed in blocks of frames so an
+    # hour-long chapter never holds more than one block of FFTs
+    frame_samples = sample_rate * frame_ms // 1000
+    frames = audio[:len(audio) - len(audio) % frame_samples].reshape(-1, frame_samples)
+    energies = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    flatness = np.empty(len(frames))
+    taper = np.hanning(frame_samples)
+    for block_start in range(0, len(frames), block_frames):
+        block = slice(block_start, block_start + block_frames)
+        power = np.abs(np.fft.rfft(frames[block] * taper, axis=1)) ** 2 + 1e-12
+        flatness[block] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return energies, flatness
+
+
+def energy_modulation(energies, window_frames):
+    # Standard deviation of the energy (dB) over a centred window, from running sums
+    padded = np.pad(energies, window_frames // 2, mode='edge')
+    sums = np.concatenate(([0.0], np.cumsum(padded)))
+    squares = np.concatenate(([0.0], np.cumsum(padded * padded)))
+    window_sums = sums[window_frames:] - sums[:-window_frames]
+    window_squares = squares[window_frames:] - squares[:-window_frames]
+    means = window_sums / window_frames
+    return np.sqrt(np.maximum(window_squares / window_frames - means * means, 0))[:len(energies)]
+
+
+def find_speech_regions(audio, sample_rate=16000, frame_ms=30, min_non_speech_ms=2000, pad_ms=300,
+                        silence_db=10, flatness_threshold=0.5, steady_db=3.0, modulation_ms=1000):
+    # Returns the (start_ms, end_ms) spans to transcribe, in order. Non-speech runs shorter than
+    # min_non_speech_ms are kept, and every cut is narrowed by pad_ms on both sides. When nothing looks like
+    # speech the whole file is returned, so the pre-pass never empties a chapter.
+    energies, flatness = frame_features(audio, sample_rate, frame_ms)
+    total_ms = int(len(audio) * 1000 / sample_rate)
+    if len(energies) == 0:
+        return [(0, total_ms)]
+    speech = ((energies > np.percentile(energies, 10) + silence_db)
+              & (flatness < flatness_threshold)
+              & (energy_modulation(energies, max(1, modulation_ms // frame_ms)) > steady_db))
+    if not speech.any():
+        return [(0, total_ms)]
+
+    # Non-speech runs from the frame-to-frame changes of the speech mask
+    changes = np.flatnonzero(np.diff(np.concatenate(([1], speech.astype(np.int8), [1]))))
+    run_starts, run_ends = changes[::2], changes[1::2]
+    long_runs = (run_ends - run_starts) * frame_ms >= min_non_speech_ms
+
+    regions = []
+    region_start = 0
+    for run_start, run_end in zip(run_starts[long_runs], run_ends[long_runs]):
+        cut_start = int(run_start) * frame_ms + (pad_ms if run_start > 0 else 0)
+        cut_end = int(run_end) * frame_ms - (pad_ms if run_end < len(speech) else 0)
+        if cut_end <= cut_start:
+            continue
+        if cut_start > region_start:
+            regions.append((region_start, cut_start))
+        region_start = cut_end
+    if region_start < total_ms and region_start < len(speech) * frame_ms:
+        regions.append((region_start, total_ms))
+    return regions or [(0, total_ms)]
+
+
+def concatenate_regions(audio, regions, sample_rate=16000):
+    # The speech regions joined into one array, plus each region's start in it (ms)
+    samples_per_ms = sample_rate // 1000
+    pieces = [audio[start_ms * samples_per_ms:end_ms * samples_per_ms] for start_ms, end_ms in regions]
+    offsets = np.cumsum([0] + [end_ms - start_ms for start_ms, end_ms in regions[:-1]])
+    return np.concatenate(pieces), offsets
+
+
+def restore_times(times_ms, regions, offsets):
+    # Maps times in the concatenated audio back to the original timeline
+    times_ms = np.asarray(times_ms, dtype=np.int64)
+    region_index = np.searchsorted(offsets, times_ms, side='right') - 1
+    region_starts = np.array([start_ms for start_ms, _ in regions], dtype=np.int64)
+    return times_ms - offsets[region_index] + region_starts[region_index]
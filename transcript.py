@@ -0,0 +1,139 @@
+import struct
+import sys
+from array import array
+
+
+class Transcript:
+    # Struct-of-arrays transcript: interned word ids plus start/end times in contiguous arrays.
+    # transcript[i] still returns a {'word', 'start', 'end'} dict so list-of-dicts code keeps working
+    # while it is migrated; slices return Transcripts that share the vocabulary.
+
+    FILE_MAGIC = b'AVST'
+    FILE_VERSION = 1
+
+    def __init__(self, vocabulary=None, vocabulary_ids=None, word_ids=None, start_ms=None, end_ms=None):
+        self.vocabulary = vocabulary if vocabulary is not None else []
+        self.vocabulary_ids = vocabulary_ids if vocabulary_ids is not None else {
+            word: i for i, word in enumerate(self.vocabulary)
+        }
+        self.word_ids = word_ids if word_ids is not None else array('I')
+        self.start_ms = start_ms if start_ms is not None else array('i')
+        self.end_ms = end_ms if end_ms is not None else array('i')
+        self._text = None
+        self._char_offsets = None
+
+    @classmethod
+    def from_words(cls, transcribed_words):
+        transcript = cls()
+        for w in transcribed_words:
+            transcript.append(w['word'], w.get('start', 0), w.get('end', 0))
+        return transcript
+
+    def append(self, word, start_ms, end_ms):
+        word_id = self.vocabulary_ids.get(word)
+        if word_id is None:
+            word_id = len(self.vocabulary)
+            self.vocabulary.append(word)
+            self.vocabulary_ids[word] = word_id
+        self.word_ids.append(word_id)
+        self.start_ms.append(start_ms)
+        self.end_ms.append(end_ms)
+        self._text = None
+        self._char_offsets = None
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Transcript(self.vocabulary, self.vocabulary_ids, self.word_ids[index],
+                              self.start_ms[index], self.end_ms[index])
+        return {
+            'word': self.vocabulary[self.word_ids[index]],
+            'start': self.start_ms[index],
+            'end': self.end_ms[index]
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def word(self, index):
+        return self.vocabulary[self.word_ids[index]]
+
+    @property
+    def words(self):
+        vocabulary = self.vocabulary
+        return [vocabulary[word_id] for word_id in self.word_ids]
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ' '.join(self.words)
+        return self._text
+
+    @property
+    def char_offsets(self):
+        # char_offsets[k] is where word k starts in text; words start:end span
+        # text[char_offsets[start]:char_offsets[end] - 1]
+        if self._char_offsets is None:
+            vocabulary = self.vocabulary
+            offsets = array('i', [0])
+            position = 0
+            for word_id in self.word_ids:
+                position += len(vocabulary[word_id]) + 1
+                offsets.append(position)
+            self._char_offsets = offsets
+        return self._char_offsets
+
+    def join(self, start, end):
+        # Same as ' '.join(words[start:end]), read from the cached text
+        start = max(0, min(start, len(self)))
+        end = max(start, min(end, len(self)))
+        if start == end:
+            return ''
+        offsets = self.char_offsets
+        return self.text[offsets[start]:offsets[end] - 1]
+
+    def to_words(self):
+        return list(self)
+
+    def save(self, path):
+        vocabulary_bytes = '\0'.join(self.vocabulary).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(self.FILE_MAGIC)
+            f.write(struct.pack('<IIII', self.FILE_VERSION, len(self.vocabulary), len(self), len(vocabulary_bytes)))
+            f.write(vocabulary_bytes)
+            for values in (self.word_ids, self.start_ms, self.end_ms):
+                f.write(_little_endian(values).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(cls.FILE_MAGIC)) != cls.FILE_MAGIC:
+                raise ValueError(f"Not a transcript file: {path}")
+            version, vocabulary_count, word_count, vocabulary_length = struct.unpack('<IIII', f.read(16))
+            if version != cls.FILE_VERSION:
+                raise ValueError(f"Unsupported transcript file version {version}: {path}")
+            vocabulary_text = f.read(vocabulary_length).decode('utf-8')
+            vocabulary = vocabulary_text.split('\0') if vocabulary_count else []
+            columns = []
+            for typecode in ('I', 'i', 'i'):
+                values = array(typecode)
+                values.frombytes(f.read(word_count * values.itemsize))
+                columns.append(_little_endian(values))
+        return cls(vocabulary, None, *columns)
+
+
+def as_transcript(transcribed_words):
+    if isinstance(transcribed_words, Transcript):
+        return transcribed_words
+    return Transcript.from_words(transcribed_words)
+
+
+def _little_endian(values):
+    if sys.byteorder == 'little':
+        return values
+    swapped = array(values.typecode, values)
+    swapped.byteswap()
+    return swapped
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from transcript import Transcript
+
+# On-disk transcript cache keyed by the audio content hash, model name and version, language and decoding
+# options. Entries are Transcript binary files; index.json keeps their metadata so the least recently used
+# entries can be evicted once the cache grows past max_bytes and entries can be dropped by model version.
+
+
+class TranscriptCache:
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, cache_dir='transcript_cache', max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (path, size, mtime) -> content hash, so a file is hashed once per process
+        self._audio_hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def audio_hash(self, audio_file):
+        stat = os.stat(audio_file)
+        file_key = (os.path.abspath(audio_file), stat.st_size, stat.st_mtime_ns)
+        digest = self._audio_hashes.get(file_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(audio_file, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            self._audio_hashes[file_key] = digest
+        return digest
+
+    def make_key(self, audio_file, model_name, model_version, language, decode_options=None):
+        key_fields = {
+            'audio': self.audio_hash(audio_file),
+            'model': model_name,
+            'model_version': model_version,
+            'language': language,
+            'options': decode_options or {},
+        }
+        key = hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+        return key, key_fields
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._read_index() and os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        with self._lock:
+            index = self._read_index()
+            entry = index.get(key)
+            path = self._entry_path(key)
+            if entry is None or not os.path.exists(path):
+                return None
+            try:
+                transcript = Transcript.load(path)
+            except (OSError, ValueError) as e:
+                print(f"Discarding unreadable cached transcript {path}: {e}")
+                self._remove_entry(index, key)
+                self._write_index(index)
+                return None
+            entry['last_used'] = time.time()
+            self._write_index(index)
+            return transcript
+
+    def put(self, key, key_fields, transcript):
+        with self._lock:
+            path = self._entry_path(key)
+            temp_path = f"{path}.tmp{os.getpid()}"
+            transcript.save(temp_path)
+            os.replace(temp_path, path)
+            index = self._read_index()
+            index[key] = dict(key_fields, size=os.path.getsize(path), last_used=time.time())
+            self._evict(index)
+            self._write_index(index)
+
+    def invalidate(self, model_name=None, model_version=None, keep_version=None):
+        # Drops entries of model_name (any model when None) whose version is model_version, or whose version
+        # differs from keep_version; returns the number of entries removed
+        with self._lock:
+            index = self._read_index()
+            removed = 0
+            for key, entry in list(index.items()):
+                if model_name is not None and entry.get('model') != model_name:
+                    continue
+                if model_version is not None and entry.get('model_version') != model_version:
+                    continue
+                if keep_version is not None and entry.get('model_version') == keep_version:
+                    continue
+                self._remove_entry(index, key)
+                removed += 1
+            self._write_index(index)
+        return removed
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self._read_index().values())
+
+    def _evict(self, index):
+        total = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= index[key]['size']
+            self._remove_entry(index, key)
+
+    def _remove_entry(self, index, key):
+        index.pop(key, None)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _read_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            print(f"Transcript cache index {index_path} is corrupt; starting a new one")
+            return {}
+
+    def _write_index(self, index):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        temp_path = f"{index_path}.tmp{os.getpid()}"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+
+
+_caches = {}
+
+
+def get_transcript_cache(cache_dir='transcript_cache', max_bytes=1024 * 1024 * 1024):
+    # One cache object per directory, so audio hashes are remembered across chapters
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = TranscriptCache(cache_dir, max_bytes)
+    cache.max_bytes = max_bytes
+    return cache
@@ -0,0 +1,107 @@
+import os
+import time
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import model_registry
+from chunked_transcription import transcribe_chunked, SAMPLE_RATE
+from pcm_audio import decode_asr_audio
+from speech_regions import find_speech_regions, concatenate_regions, restore_times
+from transcript import Transcript
+
+# Chapters transcribed by N worker processes, each limited to a fixed share of the CPU threads and holding its
+# own resident model. Chapters are submitted ahead of time (prefetch) and their results are picked up in chapter
+# order, so alignment and splitting run exactly as in the sequential path while later chapters transcribe.
+
+
+def transcribe_words(audio_file, language, whisper_model='small', whisper_device=None, whisper_precision=None,
+                     transcription_chunk_ms=None, chunk_overlap_ms=1000, transcription_workers=1,
+                     skip_non_speech=False, audio=None):
+    # audio: the chapter's 16 kHz mono float32 samples when already decoded (see PcmAudio.asr_view)
+    if audio is None:
+        # The same samples as the chapter's asr_view, so workers and this process transcribe identical input
+        audio = decode_asr_audio(audio_file)
+    regions = None
+    if skip_non_speech:
+        # Only the speech regions are transcribed; word times are mapped back to the chapter afterwards
+        regions = find_speech_regions(audio)
+        audio, offsets = concatenate_regions(audio, regions)
+        print(f"Skipping non-speech: transcribing {len(audio) / SAMPLE_RATE:.1f}s of {regions[-1][1] / 1000:.1f}s "
+              f"in {len(regions)} speech regions")
+
+    transcribed_words = Transcript()
+    if transcription_chunk_ms:
+        # Chunks cut at silences, so memory per Whisper call does not grow with the chapter
+        for word, start_ms, end_ms in transcribe_chunked(audio_file, language, whisper_model, whisper_device,
+                                                         whisper_precision, transcription_chunk_ms,
+                                                         2 * transcription_chunk_ms, chunk_overlap_ms,
+                                                         transcription_workers, audio):
+            transcribed_words.append(word.strip().lower(), start_ms, end_ms)
+    else:
+        # The model is loaded once per (name, device, precision) and reused for every chapter
+        result = model_registry.transcribe(audio, language, whisper_model, whisper_device, whisper_precision,
+                                           word_timestamps=True)
+        for segment in result["segments"]:
+            for word in segment["words"]:
+                transcribed_words.append(
+                    word["word"].strip().lower(),
+                    int(word["start"] * 1000),
+                    int(word["end"] * 1000)
+                )
+    if regions is not None and len(transcribed_words):
+        transcribed_words.start_ms = array('i', restore_times(transcribed_words.start_ms, regions, offsets).tolist())
+        transcribed_words.end_ms = array('i', restore_times(transcribed_words.end_ms, regions, offsets).tolist())
+    return transcribed_words
+
+
+def _init_worker(threads, whisper_model, whisper_device, whisper_precision, warm_up):
+    torch.set_num_threads(threads)
+    if warm_up:
+        model_registry.warm_up(whisper_model, whisper_device, whisper_precision)
+
+
+def _transcribe_in_worker(audio_file, language, options):
+    start_time = time.time()
+    transcribed_words = transcribe_words(audio_file, language, **options)
+    return transcribed_words, time.time() - start_time
+
+
+class TranscriptionPool:
+    def __init__(self, workers, threads_per_worker=None, whisper_model='small', whisper_device=None,
+                 whisper_precision=None, warm_up=True):
+        # threads_per_worker None splits the machine's cores evenly between the workers
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        print(f"Starting {workers} transcription workers with {self.threads_per_worker} threads each")
+        # spawn: forking a process that already started torch thread pools (or CUDA) is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, whisper_model, whisper_device, whisper_precision, warm_up)
+        )
+        self._futures = {}
+
+    def _job_key(self, audio_file, language, options):
+        return os.path.abspath(audio_file), language, tuple(sorted(options.items()))
+
+    def prefetch(self, audio_file, language, **options):
+        key = self._job_key(audio_file, language, options)
+        if key not in self._futures:
+            self._futures[key] = self.executor.submit(_transcribe_in_worker, audio_file, language, options)
+
+    def transcribe(self, audio_file, language, **options):
+        # Waits for a prefetched chapter (submitting it first if it was not prefetched)
+        self.prefetch(audio_file, language, **options)
+        transcribed_words, elapsed = self._futures.pop(self._job_key(audio_file, language, options)).result()
+        model_registry.timings['transcriptions'] += 1
+        model_registry.timings['transcribe_seconds'] += elapsed
+        print(f"Transcribed in {elapsed:.2f} seconds (worker process)")
+        return transcribed_words
+
+    def shutdown(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        self.executor.shutdown()
@@ -0,0 +1,148 @@
+import os
+import json
+import mmap
+import subprocess
+from ffmpeg_split import read_packets, nearest_index
+
+# Virtual verse split: each chapter is written once as a single mp3 (a stream copy of an mp3 source, one encode
+# otherwise) next to an index of verse -> (start_ms, end_ms, byte offset, byte length, priming_ms). A verse's byte
+# range is a run of whole mp3 frames cut at the frame boundaries nearest its times, so it can be served with an
+# HTTP range request or read with ChapterReader instead of being materialized as a file. A frame decoded without
+# the frames before it comes out wrong (its bit reservoir and transform overlap are missing), so each range starts
+# with the frames its first verse frame depends on; decoded alone, a range gives priming_ms of audio from before
+# the verse and then the verse's samples as in a decode of the whole chapter.
+
+MPEG1_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Sample rates by the header's version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mp3_frame_offsets(data):
+    # (byte offset of every Layer III audio frame, end of the last frame), skipping an ID3v2 tag and a leading
+    # Xing/Info/VBRI header frame
+    position = 0
+    if data[:3] == b'ID3':
+        position = 10 + (data[6] << 21 | data[7] << 14 | data[8] << 7 | data[9]) + (10 if data[5] & 0x10 else 0)
+    offsets = []
+    while position + 4 <= len(data):
+        header = int.from_bytes(data[position:position + 4], 'big')
+        version = header >> 19 & 3
+        bitrate_index = header >> 12 & 15
+        sample_rate_index = header >> 10 & 3
+        if (header >> 21 != 0x7ff or version == 1 or header >> 17 & 3 != 1 or bitrate_index in (0, 15)
+                or sample_rate_index == 3):
+            break
+        bitrate = (MPEG1_BITRATES if version == 3 else MPEG2_BITRATES)[bitrate_index]
+        offsets.append(position)
+        position += ((144 if version == 3 else 72) * 1000 * bitrate // SAMPLE_RATES[version][sample_rate_index]
+                     + (header >> 9 & 1))
+    if offsets and any(tag in data[offsets[0]:offsets[0] + 64] for tag in (b'Xing', b'Info', b'VBRI')):
+        offsets = offsets[1:]
+    return offsets, position
+
+
+def priming_frame(data, frame_starts, frame_ends, first):
+    # Index of the first frame a decoder needs before frame first for it to decode as in the whole chapter. A
+    # granule's output depends on the two granules before it (synthesis filter history, and that granule's
+    # transform overlap): the previous frame for MPEG-1 (two granules per frame), the previous two for MPEG-2/2.5.
+    # Those frames decode correctly once every frame holding part of their main data is there too (the bit
+    # reservoir, main_data_begin bytes back from their side information).
+    header = int.from_bytes(data[frame_starts[first]:frame_starts[first] + 4], 'big')
+    frame = max(0, first - (1 if header >> 19 & 3 == 3 else 2))
+    needed = main_data_begin(data, frame_starts[frame])
+    while needed > 0 and frame > 0:
+        frame -= 1
+        needed -= frame_ends[frame] - frame_starts[frame] - side_info_end(data, frame_starts[frame])
+    return min(frame, first)
+
+
+def side_info_end(data, position):
+    # Bytes from the start of a frame to the end of its side information (header, CRC, side info)
+    header = int.from_bytes(data[position:position + 4], 'big')
+    mono = header >> 6 & 3 == 3
+    if header >> 19 & 3 == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    return 4 + (0 if header >> 16 & 1 else 2) + side_info
+
+
+def main_data_begin(data, position):
+    header = int.from_bytes(data[position:position + 4], 'big')
+    side = position + 4 + (0 if header >> 16 & 1 else 2)
+    if header >> 19 & 3 == 3:
+        return data[side] << 1 | data[side + 1] >> 7
+    return data[side]
+
+
+def write_chapter(audio_file, segments, output_path, chapter_name):
+    # segments: (verse_ref, start_ms, end_ms) per verse. Writes <chapter_name>.mp3 and <chapter_name>_index.json
+    # to output_path; returns the chapter file and the (start_ms, end_ms) each verse's byte range holds.
+    os.makedirs(output_path, exist_ok=True)
+    chapter_file = os.path.join(output_path, f"{chapter_name}.mp3")
+    codec = read_packets(audio_file)[0]
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', audio_file, '-map', '0:a:0', '-map_metadata', '-1',
+         '-c:a', 'copy' if codec == 'mp3' else 'libmp3lame', '-id3v2_version', '0', chapter_file],
+        check=True
+    )
+
+    _, _, packet_starts, packet_ends = read_packets(chapter_file)
+    # Bare frames carry no gapless header, so a decoder skips nothing and a range is heard from its first frame's
+    # timestamp (unlike a stream-copied verse file, see ffmpeg_split.MP3_DECODER_DELAY). Each range starts with the
+    # priming frames its first frame needs; they decode to priming_ms of audio before the verse, to be dropped.
+    verses = {}
+    exported_times = []
+    with open(chapter_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        frame_starts, frames_end = mp3_frame_offsets(data)
+        if len(frame_starts) != len(packet_starts):
+            raise ValueError(f"{chapter_file}: {len(frame_starts)} mp3 frames but {len(packet_starts)} packets")
+        frame_ends = frame_starts[1:] + [frames_end]
+        for verse_ref, start_ms, end_ms in segments:
+            first = nearest_index(packet_starts, start_ms)
+            last = max(first, nearest_index(packet_ends, end_ms))
+            times = (int(round(packet_starts[first])), int(round(packet_ends[last])))
+            primed = priming_frame(data, frame_starts, frame_ends, first)
+            verses[verse_ref] = [*times, frame_starts[primed], frame_ends[last] - frame_starts[primed],
+                                 round(packet_starts[first] - packet_starts[primed], 3)]
+            exported_times.append(times)
+    with open(os.path.join(output_path, f"{chapter_name}_index.json"), 'w', encoding='utf-8') as f:
+        json.dump({'audio_file': os.path.basename(chapter_file), 'verses': verses}, f, ensure_ascii=False)
+    return chapter_file, exported_times
+
+
+class ChapterReader:
+    # Verses of a chapter written by write_chapter. verse_bytes returns a memoryview into the memory-mapped
+    # chapter file, so nothing is copied until the caller writes or sends it; views must be released before
+    # close.
+    def __init__(self, index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.verses = {verse_ref: tuple(entry) for verse_ref, entry in index['verses'].items()}
+        self.audio_file = os.path.join(os.path.dirname(index_path), index['audio_file'])
+        with open(self.audio_file, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def times(self, verse_ref):
+        # (start_ms, end_ms) in the chapter
+        return self.verses[verse_ref][:2]
+
+    def priming_ms(self, verse_ref):
+        # Audio at the start of the decoded verse_bytes that precedes the verse
+        return self.verses[verse_ref][4]
+
+    def verse_bytes(self, verse_ref):
+        _, _, offset, length, _ = self.verses[verse_ref]
+        return self._view[offset:offset + length]
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
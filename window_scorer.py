@@ -0,0 +1,156 @@
+from transcript import as_transcript
+
+try:
+    import numpy as np
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+    from rapidfuzz.process import cdist
+except ImportError:
+    cdist = None
+
+
+def ratio_upper_bound(window_length, verse_length):
+    # LCS <= min(a, b), so fuzz.ratio can never exceed 100 * 2 * min(a, b) / (a + b)
+    lensum = window_length + verse_length
+    if window_length == 0 or verse_length == 0:
+        return 0
+    return int(round(100 * (1 - (lensum - 2 * min(window_length, verse_length)) / lensum)))
+
+
+def new_search_counters():
+    return {'candidates': 0, 'scored': 0, 'pruned_bound': 0, 'pruned_length': 0}
+
+
+class BatchWindowScorer:
+    # Scores every (start, end) window of a chapter transcript against a verse in one pass per start
+    # index, reproducing fuzz.ratio (Levenshtein backend) exactly.
+    #
+    # fuzz.ratio(a, b) is the normalized indel similarity 1 - (len(a) + len(b) - 2 * LCS) / (len(a) + len(b)).
+    # The chapter text is joined once and every window is a slice of it taken from the word offset table.
+    # With rapidfuzz installed (python-Levenshtein depends on it) all windows of a verse go through one
+    # cdist call; otherwise the LCS against the verse is advanced one character at a time with a
+    # bit-parallel kernel (Hyyro 2004), so windows sharing a start index are read off the same running
+    # state at their word boundaries instead of being re-joined and re-scored.
+
+    def __init__(self, transcribed_words):
+        transcript = as_transcript(transcribed_words)
+        self.text = transcript.text
+        # word_offsets[k] is the char position where word k starts; window(start, end) is
+        # text[word_offsets[start]:word_offsets[end] - 1]
+        self.word_offsets = transcript.char_offsets
+        self._offsets = None
+
+    def window_text(self, start, end):
+        return self.text[self.word_offsets[start]:self.word_offsets[end] - 1]
+
+    def best_window(self, verse_text, start_window, end_window, min_window_length=0, max_window_length=None):
+        # Same iteration order and strict '>' tie-breaking as the nested loop in align_verses.
+        # Windows outside [min_window_length, max_window_length] chars are skipped unscored, and with rapidfuzz
+        # so are windows whose ratio_upper_bound cannot reach the best ratio.
+        counters = new_search_counters()
+        window_count = max(0, end_window - start_window)
+        counters['candidates'] = window_count * (window_count - 1) // 2
+        if not verse_text:
+            counters['pruned_length'] = counters['candidates']
+            return 0, None, None, counters
+        if max_window_length is None:
+            max_window_length = len(self.text)
+
+        if cdist is not None:
+            best_ratio, best_start, best_end = self._best_window_cdist(
+                verse_text, start_window, end_window, min_window_length, max_window_length, counters)
+            return best_ratio, best_start, best_end, counters
+
+        best_ratio = 0
+        best_start = None
+        best_end = None
+        for start, end, ratio in self._iter_scores(verse_text, start_window, end_window, min_window_length, max_window_length):
+            counters['scored'] += 1
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_start = start
+                best_end = end
+        counters['pruned_length'] = counters['candidates'] - counters['scored']
+        return best_ratio, best_start, best_end, counters
+
+    def _best_window_cdist(self, verse_text, start_window, end_window, min_window_length, max_window_length, counters):
+        # Windows in loop order with their ratio_upper_bound. The window with the highest bound of every start is
+        # scored first; windows whose bound is below the best of those cannot win and are never scored. Every
+        # window that could reach the best ratio is scored, so the first best window in loop order is the one the
+        # fuzz.ratio loop keeps.
+        if self._offsets is None:
+            self._offsets = np.asarray(self.word_offsets, dtype=np.int64)
+        offsets = self._offsets
+        starts = np.concatenate([np.full(end_window - start - 1, start, dtype=np.int64)
+                                 for start in range(start_window, end_window - 1)] or [np.empty(0, np.int64)])
+        ends = np.concatenate([np.arange(start + 1, end_window, dtype=np.int64)
+                               for start in range(start_window, end_window - 1)] or [np.empty(0, np.int64)])
+        lengths = offsets[ends] - 1 - offsets[starts]
+        in_range = (lengths >= min_window_length) & (lengths <= max_window_length)
+        starts, ends, lengths = starts[in_range], ends[in_range], lengths[in_range]
+        counters['pruned_length'] = counters['candidates'] - len(starts)
+        if not len(starts):
+            return 0, None, None
+
+        verse_length = len(verse_text)
+        lensum = lengths + verse_length
+        bounds = np.where(lengths == 0, 0, np.round(100 * (1 - (lensum - 2 * np.minimum(lengths, verse_length)) / lensum)))
+        group_starts = np.flatnonzero(np.diff(starts, prepend=-1))
+        seeds = np.array([group_start + int(np.argmax(group_bounds)) for group_start, group_bounds
+                          in zip(group_starts, np.split(bounds, group_starts[1:]))])
+
+        ratios = np.full(len(starts), -1.0)
+        ratios[seeds] = self._ratios(verse_text, starts[seeds], ends[seeds])
+        candidates = np.flatnonzero(bounds >= ratios[seeds].max())
+        unscored = candidates[ratios[candidates] < 0]
+        ratios[unscored] = self._ratios(verse_text, starts[unscored], ends[unscored])
+        counters['scored'] = len(seeds) + len(unscored)
+        counters['pruned_bound'] = len(starts) - counters['scored']
+
+        best_index = int(candidates[np.argmax(ratios[candidates])])
+        best_ratio = int(ratios[best_index])
+        if best_ratio == 0:
+            return 0, None, None
+        return best_ratio, int(starts[best_index]), int(ends[best_index])
+
+    def _ratios(self, verse_text, starts, ends):
+        if not len(starts):
+            return np.empty(0)
+        window_texts = [self.window_text(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+        # fuzz.ratio rounds 100 * similarity with Python's round(), which np.round matches (half to even)
+        return np.round(cdist([verse_text], window_texts, scorer=rapidfuzz_fuzz.ratio, dtype=np.float64)[0])
+
+    def _iter_scores(self, verse_text, start_window, end_window, min_window_length, max_window_length):
+        verse_length = len(verse_text)
+        full_mask = (1 << verse_length) - 1
+        char_masks = {}
+        for i, char in enumerate(verse_text):
+            char_masks[char] = char_masks.get(char, 0) | (1 << i)
+        space_mask = char_masks.get(' ', 0)
+        text = self.text
+        offsets = self.word_offsets
+
+        for start in range(start_window, end_window - 1):
+            state = full_mask
+            window_start = offsets[start]
+            for end in range(start + 1, end_window):
+                if end - 1 > start:
+                    state = self._advance(state, space_mask, full_mask)
+                for char in text[offsets[end - 1]:offsets[end] - 1]:
+                    state = self._advance(state, char_masks.get(char, 0), full_mask)
+
+                window_length = offsets[end] - 1 - window_start
+                if window_length > max_window_length:
+                    break
+                if window_length < min_window_length:
+                    continue
+                if window_length == 0:
+                    yield start, end, 0
+                    continue
+                lcs = verse_length - bin(state).count('1')
+                lensum = verse_length + window_length
+                yield start, end, int(round(100 * (1 - (lensum - 2 * lcs) / lensum)))
+
+    @staticmethod
+    def _advance(state, match_mask, full_mask):
+        matched = state & match_mask
+        return ((state + matched) | (state - matched)) & full_mask